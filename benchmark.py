@@ -0,0 +1,387 @@
+"""
+CSC110 Course Project: Air Pollution and Forestry
+=========================================================================================
+benchmark.py
+Times the loading, querying, regression, and plotting code on synthetic datasets of
+different sizes, and compares the timings with the ones of an earlier run.
+
+Usage:
+    python benchmark.py --scales 260 10000 --output results.json
+    python benchmark.py --baseline results.json
+=========================================================================================
+@author: Tu Anh Pham
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy
+from bokeh.document import Document
+from bokeh.models import ColumnDataSource
+
+import bootstrap
+import data_extract
+import presentation
+import regression
+from data_manager import DataManager
+
+# The numbers of entities (countries, or smaller areas) of the synthetic datasets.
+DEFAULT_SCALES = [260, 1000, 10000, 100000]
+
+# The years of the synthetic datasets.
+YEARS = list(range(1990, 2020))
+
+# The years used by the gapminder plot and by the data point queries.
+GAPMINDER_YEARS = [1990, 1995, 2000, 2005] + list(range(2010, 2018))
+QUERY_YEARS = list(range(2010, 2018))
+
+# The regions and sub-regions of the synthetic datasets.
+REGIONS = {'Africa': ['Northern Africa', 'Sub-Saharan Africa'],
+           'Americas': ['Latin America and the Caribbean', 'Northern America'],
+           'Asia': ['Eastern Asia', 'South-eastern Asia', 'Southern Asia'],
+           'Europe': ['Eastern Europe', 'Western Europe'],
+           'Oceania': ['Australia and New Zealand', 'Melanesia']}
+
+# The indicators of the synthetic datasets and the (low, high) range of their values.
+INDICATORS = {'air pollution': (5.0, 100.0),
+              'population': (1e4, 1e9),
+              'gdp per capita': (200.0, 1e5),
+              'hdi': (0.3, 0.95)}
+
+# The fraction of the values of the synthetic datasets that are missing.
+MISSING_FRACTION = 0.05
+
+# How much slower (as a fraction) than the baseline a benchmark must be to be reported.
+DEFAULT_TOLERANCE = 0.25
+
+
+def make_dataset(folder: str, num_entities: int, seed: int = 0) -> Tuple[str, str,
+                                                                          List[Tuple[str, str]]]:
+    """Write a synthetic dataset of num_entities entities into the given folder: a
+    geography file like Data/country_by_region.json and one formatted data file per
+    indicator of INDICATORS. The same seed always gives the same dataset.
+
+    Returns the path of the air pollution file, the path of the geography file, and the
+    (file path, indicator name) pairs of the other data files.
+
+    Preconditions:
+        - num_entities > 0
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = numpy.random.default_rng(seed)
+    codes = ['E' + str(i).zfill(6) for i in range(num_entities)]
+    names = ['Entity ' + str(i) if i % 10 != 0 else 'Entity, ' + str(i)
+             for i in range(num_entities)]
+
+    # Accumulator: The geography of the entities.
+    geography_so_far = []
+    region_names = sorted(REGIONS)
+    region_choices = rng.integers(0, len(region_names), size=num_entities)
+    for i in range(num_entities):
+        region = region_names[region_choices[i]]
+        geography_so_far.append({'name': names[i], 'alpha-3': codes[i], 'region': region,
+                                 'sub-region': REGIONS[region][i % len(REGIONS[region])],
+                                 'intermediate-region': ''})
+
+    geo_filepath = os.path.join(folder, 'country_by_region.json')
+    with open(geo_filepath, 'w') as file:
+        json.dump(geography_so_far, file)
+
+    # Accumulator: The (file path, indicator name) pairs of the data files.
+    files_so_far = []
+    for indicator, (low, high) in INDICATORS.items():
+        values = rng.uniform(low, high, size=(num_entities, len(YEARS)))
+        missing = rng.random(size=values.shape) < MISSING_FRACTION
+        filepath = os.path.join(folder, indicator.replace(' ', '_') + '_formatted.csv')
+        with open(filepath, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Country Name', 'Country Code'] + [str(year) for year in YEARS])
+            for i in range(num_entities):
+                writer.writerow([names[i], codes[i]] +
+                                ['' if missing[i, j] else repr(float(values[i, j]))
+                                 for j in range(len(YEARS))])
+        files_so_far.append((filepath, indicator))
+
+    return (files_so_far[0][0], geo_filepath, files_so_far[1:])
+
+
+def time_call(function: Callable[[], Any], repeat: int,
+              setup: Optional[Callable[[], Any]] = None) -> Dict[str, float]:
+    """Call function() repeat times and return the minimum and the median number of
+    seconds taken. setup(), if given, is called before every call and is not timed.
+
+    Preconditions:
+        - repeat > 0
+    """
+    # Accumulator: The number of seconds taken by every call.
+    seconds_so_far = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        seconds_so_far.append(time.perf_counter() - start)
+
+    return {'min': min(seconds_so_far), 'median': statistics.median(seconds_so_far),
+            'repeat': repeat}
+
+
+def run_benchmarks(num_entities: int, repeat: int, folder: str) -> Dict[str, Dict[str, float]]:
+    """Returns the timings of every benchmark on a synthetic dataset of num_entities
+    entities, written into the given folder.
+
+    Preconditions:
+        - num_entities > 0
+        - repeat > 0
+    """
+    air_filepath, geo_filepath, indicator_files = make_dataset(folder, num_entities)
+    snapshot_folder = os.path.join(folder, '.snapshots')
+
+    def remove_snapshots() -> None:
+        """Make the next load parse the data files again."""
+        shutil.rmtree(snapshot_folder, ignore_errors=True)
+
+    def load() -> DataManager:
+        """Returns a data manager loaded with every file of the dataset."""
+        return DataManager(air_filepath, geo_filepath, indicator_files)
+
+    # Accumulator: The timings of every benchmark.
+    timings = {}
+    timings['load (parse)'] = time_call(load, repeat, remove_snapshots)
+    timings['load (snapshots)'] = time_call(load, repeat)
+
+    # The data manager that load_data is timed on, created again before every call.
+    managers = []
+
+    def new_manager() -> None:
+        """Create a data manager without the last data file, and remove the snapshots."""
+        managers[:] = [DataManager(air_filepath, geo_filepath, indicator_files[:-1])]
+        remove_snapshots()
+
+    timings['load_data (parse)'] = time_call(
+        lambda: managers[0].load_data(*indicator_files[-1]), repeat, new_manager)
+
+    # The parser of the data files, against parsing every cell like it was done before.
+    filepath = indicator_files[-1][0]
+    timings['read_formatted_table'] = time_call(
+        lambda: data_extract.read_formatted_table(filepath), repeat)
+    timings['read_formatted_table (cell by cell)'] = time_call(
+        lambda: _read_cell_by_cell(filepath), repeat)
+
+    manager = load()
+
+    gapminder_args = (GAPMINDER_YEARS, 'population', 'gdp per capita', 'air pollution')
+    timings['get_gapminder_data_from_regions (world)'] = time_call(
+        lambda: manager.get_gapminder_data_from_regions(*gapminder_args), repeat)
+    timings['get_gapminder_data_from_regions (one region)'] = time_call(
+        lambda: manager.get_gapminder_data_from_regions(*gapminder_args,
+                                                        regions={'Europe'}), repeat)
+
+    for region in [None, 'Europe', 'Western Europe']:
+        timings['get_data_points (' + str(region) + ')'] = time_call(
+            lambda region=region: manager.get_data_points(QUERY_YEARS, 'hdi',
+                                                          'air pollution', region), repeat)
+
+    points = manager.get_data_points(QUERY_YEARS, 'hdi', 'air pollution')
+    timings.update(_time_regression(points, repeat))
+    timings.update(_time_figures(manager, points, repeat))
+    return timings
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any],
+            tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Returns a description of every benchmark of results whose minimum time is more than
+    (1 + tolerance) times its minimum time in baseline. Benchmarks missing from either one
+    are not compared.
+
+        - results and baseline are in the format written by main.
+    """
+    # Accumulator: The descriptions of the regressions found.
+    regressions_so_far = []
+    for scale, timings in results['results'].items():
+        for name, timing in timings.items():
+            if name in baseline['results'].get(scale, {}):
+                old = baseline['results'][scale][name]['min']
+                if timing['min'] > old * (1 + tolerance):
+                    regressions_so_far.append(
+                        scale + ' entities, ' + name + ': ' + format(timing['min'], '.4g') +
+                        ' s (baseline ' + format(old, '.4g') + ' s)')
+
+    return regressions_so_far
+
+
+def main(argv: List[str]) -> int:
+    """Run the benchmarks as described by the command line arguments argv, print the
+    results, and write them as JSON.
+
+    Returns 1 if a baseline was given and a benchmark got slower than it, or 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the air pollution simulator.')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help='the numbers of entities of the synthetic datasets.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='how many times each benchmark is run.')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='the JSON file the results are written to.')
+    parser.add_argument('--baseline', default=None,
+                        help='a JSON file written by an earlier run to compare the results with.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='how much slower (as a fraction) than the baseline is a regression.')
+    args = parser.parse_args(argv)
+
+    results = {'environment': {'python': platform.python_version(),
+                               'numpy': numpy.__version__,
+                               'machine': platform.machine(),
+                               'cpus': os.cpu_count()},
+               'repeat': args.repeat,
+               'results': {}}
+    folder = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        for num_entities in args.scales:
+            timings = run_benchmarks(num_entities, args.repeat,
+                                     os.path.join(folder, str(num_entities)))
+            results['results'][str(num_entities)] = timings
+            for name, timing in timings.items():
+                print(str(num_entities).rjust(7), name.ljust(48),
+                      format(timing['min'] * 1000, '10.3f'), 'ms')
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    for description in regressions:
+        print('Slower than the baseline:', description)
+
+    return 1 if regressions else 0
+
+
+# Helper functions
+def _read_cell_by_cell(filepath: str) -> Tuple[List[str], List[str], List[int], numpy.ndarray]:
+    """Returns the table of the given data file like data_extract.read_formatted_table,
+    but reading it line by line and converting every cell separately, as the files were
+    parsed before the chunks were read by NumPy."""
+    years, year_cols, _, header_end = data_extract.read_formatted_header(filepath)
+
+    # Accumulator: The tables of the chunks of the file.
+    tables_so_far = []
+    with open(filepath, 'rb') as file:
+        file.seek(header_end)
+        while True:
+            lines = []
+            for _ in range(data_extract.DEFAULT_CHUNK_ROWS):
+                line = file.readline()
+                if not line:
+                    break
+                lines.append(line.decode('utf-8'))
+
+            rows = [row for row in csv.reader(lines) if len(row) >= 2]
+            tables_so_far.append(data_extract.parse_formatted_rows(rows, years, year_cols))
+            if len(lines) < data_extract.DEFAULT_CHUNK_ROWS:
+                break
+
+    return ([name for table in tables_so_far for name in table[0]],
+            [code for table in tables_so_far for code in table[1]], years,
+            numpy.concatenate([table[3] for table in tables_so_far]))
+
+
+def _time_regression(points: List[Tuple[float, float]], repeat: int) \
+        -> Dict[str, Dict[str, float]]:
+    """Returns the timings of the functions of regression.py on the given data points.
+
+    Preconditions:
+        - len(points) > 2
+    """
+    x, y = regression.to_arrays(points)
+    ys = regression.convert_points(points)[1]
+    a, b = regression.linear_regression(points)
+    curve_x = numpy.linspace(x.min(), x.max(), 1000).tolist()
+    exponential = regression.exponential_fit(x, y)
+    # Weights spread like those of the explorer, and rows like the indicators of
+    # DataManager.correlation_matrix, with a missing value in every tenth column.
+    weights = numpy.linspace(1.0, 100.0, len(x))
+    values = numpy.array([x, y, x * y, numpy.sqrt(y)])
+    values[1, ::10] = numpy.nan
+
+    benchmarks = {
+        'convert_points': lambda: regression.convert_points(points),
+        'average': lambda: regression.average(ys),
+        'to_arrays': lambda: regression.to_arrays(points),
+        'weighted_line_fit': lambda: regression.weighted_line_fit(x, y),
+        'linear_fit': lambda: regression.linear_fit(x, y),
+        'exponential_fit': lambda: regression.exponential_fit(x, y),
+        'weighted_linear_fit': lambda: regression.weighted_linear_fit(x, y, weights),
+        'theil_sen_fit': lambda: regression.theil_sen_fit(x, y),
+        'huber_fit': lambda: regression.huber_fit(x, y),
+        'r_squared': lambda: regression.r_squared(x, y, a, b),
+        'linear_regression': lambda: regression.linear_regression(points),
+        'exponential_regression': lambda: regression.exponential_regression(points),
+        'least_square_exponential_regression':
+            lambda: regression.least_square_exponential_regression(points),
+        'calculate_r_squared': lambda: regression.calculate_r_squared(points, a, b),
+        'bootstrap_band (2000 resamples)':
+            lambda: bootstrap.bootstrap_band(x, y, 'linear', numpy.array([x.min(), x.max()])),
+        'evaluate_line (1000 points)':
+            lambda: [regression.evaluate_line(a, b, 0, x_i) for x_i in curve_x],
+        'evaluate_exponential_curve (1000 points)':
+            lambda: [regression.evaluate_exponential_curve(0.0, 0.01, 0, x_i)
+                     for x_i in curve_x],
+        'sample_curve (exponential)': lambda: regression.sample_curve(
+            lambda x_i: regression.evaluate_exponential_curve(exponential.a, exponential.b,
+                                                              0, x_i),
+            float(x.min()), float(x.max())),
+        'pearson_matrix (4 rows)': lambda: regression.pearson_matrix(values),
+        'spearman_matrix (4 rows)': lambda: regression.spearman_matrix(values)
+    }
+    return {name: time_call(function, repeat) for name, function in benchmarks.items()}
+
+
+def _time_figures(manager: DataManager, points: List[Tuple[float, float]], repeat: int) \
+        -> Dict[str, Dict[str, float]]:
+    """Returns the timings of building the figures of presentation.py.
+
+    Preconditions:
+        - len(points) > 2
+    """
+    x, y = regression.to_arrays(points)
+    data = manager.get_gapminder_frames(GAPMINDER_YEARS, 'population', 'gdp per capita',
+                                        'air pollution', region_type='region')
+    regions = sorted(set(data[GAPMINDER_YEARS[0]]['region']))
+    result = presentation.compute_explorer_result(x, y, 'Least-square exponential')
+
+    benchmarks = {
+        'create_air_gpd_plot': lambda: presentation.create_air_gpd_plot(
+            ColumnDataSource(data=dict(data[GAPMINDER_YEARS[0]])), regions),
+        'create_scatter_plot': lambda: presentation.create_scatter_plot(
+            x, y, 'HDI', 'Air Pollution', ''),
+        'create_linear_regression_plot': lambda: presentation.create_linear_regression_plot(
+            x, y, 'HDI', 'Air Pollution', ''),
+        'create_exponential_regression_plot':
+            lambda: presentation.create_exponential_regression_plot(
+                x, y, 'HDI', 'Air Pollution', ''),
+        'compute_explorer_result (exponential)':
+            lambda: presentation.compute_explorer_result(x, y, 'Least-square exponential'),
+        'update_explorer_plot': lambda: presentation.update_explorer_plot(
+            presentation.create_explorer_plot(result, 'HDI', 'Air Pollution'), result,
+            'HDI', 'Air Pollution'),
+        'setup_gapminder': lambda: presentation.setup_gapminder(Document(), manager),
+        'setup_data_explorer': lambda: presentation.setup_data_explorer(manager)
+    }
+    return {name: time_call(function, repeat) for name, function in benchmarks.items()}
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
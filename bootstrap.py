@@ -0,0 +1,297 @@
+"""
+CSC110 Course Project: Air Pollution and Forestry
+=========================================================================================
+bootstrap.py
+Estimates the uncertainty of the curves of best fit of regression.py by bootstrapping:
+the points are resampled with replacement thousands of times, the curve is fitted again
+to every resample, and the spread of the fitted curves gives a confidence band.
+
+The resamples are fitted in vectorized batches, and the batches are spread over a pool
+of processes. Every batch draws from its own random stream, spawned from a single seed,
+so the result only depends on the seed, not on the number of processes.
+=========================================================================================
+@author: Tu Anh Pham
+"""
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+import numpy
+
+# The default number of resamples, confidence level, and seed of bootstrap_band.
+DEFAULT_RESAMPLES = 2000
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_SEED = 0
+
+# The maximum number of points drawn by one batch, which bounds the memory it uses.
+BATCH_POINTS = 10 ** 6
+
+# The default number of processes fitting the batches (see get_pool).
+DEFAULT_PROCESSES = os.cpu_count() or 1
+
+# The kinds of curves that can be bootstrapped, as in regression.linear_fit and
+# regression.exponential_fit.
+CURVE_KINDS = ('linear', 'exponential')
+
+# The pool of processes fitting the batches, and the number of processes it has.
+_pool = None
+_num_processes = DEFAULT_PROCESSES
+_pool_lock = threading.Lock()
+
+
+class ConfidenceBand:
+    """A confidence band around a curve of best fit.
+
+    Instance Attributes:
+        - x: The x-coordinates at which the band is evaluated.
+        - lower: The lower bound of the band at every x-coordinate.
+        - upper: The upper bound of the band at every x-coordinate.
+        - a_interval: The confidence interval of the coefficient a of the curve.
+        - b_interval: The confidence interval of the coefficient b of the curve.
+        - confidence: The confidence level of the band, such as 0.95.
+        - resamples: The number of resamples the band was estimated from.
+
+    Representation Invariants:
+        - len(self.x) == len(self.lower) == len(self.upper)
+        - 0 < self.confidence < 1
+    """
+    x: numpy.ndarray
+    lower: numpy.ndarray
+    upper: numpy.ndarray
+    a_interval: Tuple[float, float]
+    b_interval: Tuple[float, float]
+    confidence: float
+    resamples: int
+
+    def __init__(self, x: numpy.ndarray, lower: numpy.ndarray, upper: numpy.ndarray,
+                 a_interval: Tuple[float, float], b_interval: Tuple[float, float],
+                 confidence: float, resamples: int) -> None:
+        """Initialize the band. The arrays are made read-only, since bands may be shared
+        between sessions."""
+        self.x = x
+        self.lower = lower
+        self.upper = upper
+        self.a_interval = a_interval
+        self.b_interval = b_interval
+        self.confidence = confidence
+        self.resamples = resamples
+        for array in (x, lower, upper):
+            array.flags.writeable = False
+
+    def nbytes(self) -> int:
+        """Returns the approximate number of bytes used by the band."""
+        return self.x.nbytes + self.lower.nbytes + self.upper.nbytes + 256
+
+
+def bootstrap_band(x: numpy.ndarray, y: numpy.ndarray, kind: str, band_x: numpy.ndarray,
+                   weights: Optional[numpy.ndarray] = None,
+                   resamples: int = DEFAULT_RESAMPLES,
+                   confidence: float = DEFAULT_CONFIDENCE,
+                   seed: int = DEFAULT_SEED) -> ConfidenceBand:
+    """Returns the confidence band of the curve of the given kind fitted to the points
+    (x[i], y[i]), evaluated at the x-coordinates band_x.
+
+    With kind 'linear', the curve is the least-square line y = a + bx, weighted by
+    weights if it is not None. With kind 'exponential', it is the curve
+    y = exp(a) * e^(bx) fitted like regression.exponential_fit.
+
+    The band is made of the percentile intervals of the resampled curves at every
+    x-coordinate. Resamples whose x values are all the same are left out.
+
+    Preconditions:
+        - len(x) == len(y) > 0
+        - kind in CURVE_KINDS
+        - kind != 'exponential' or all(y > 0)
+        - weights is None or (len(weights) == len(x) and all(weights > 0))
+        - resamples > 0
+        - 0 < confidence < 1
+
+    >>> x = numpy.arange(100.0)
+    >>> band = bootstrap_band(x, 1 + 2 * x + numpy.sin(x), 'linear', numpy.array([0.0, 99.0]))
+    >>> bool(band.lower[0] < 1 < band.upper[0]) and bool(band.b_interval[0] < 2)
+    True
+    """
+    a, b = bootstrap_fits(x, y, kind, weights, resamples, seed)
+    curves = a[:, numpy.newaxis] + b[:, numpy.newaxis] * band_x
+    if kind == 'exponential':
+        curves = numpy.exp(curves)
+
+    tail = (1 - confidence) / 2 * 100
+    percentiles = [tail, 100 - tail]
+    lower, upper = numpy.nanpercentile(curves, percentiles, axis=0)
+    a_interval = tuple(float(value) for value in numpy.nanpercentile(a, percentiles))
+    b_interval = tuple(float(value) for value in numpy.nanpercentile(b, percentiles))
+
+    return ConfidenceBand(numpy.array(band_x, dtype=numpy.float64), lower, upper,
+                          a_interval, b_interval, confidence, resamples)
+
+
+def bootstrap_fits(x: numpy.ndarray, y: numpy.ndarray, kind: str,
+                   weights: Optional[numpy.ndarray] = None,
+                   resamples: int = DEFAULT_RESAMPLES,
+                   seed: int = DEFAULT_SEED) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Returns the arrays of the coefficients a and b of the curve of the given kind
+    fitted to resamples resamples of the points (x[i], y[i]), as in bootstrap_band.
+    The coefficients are NaN for the resamples whose x values are all the same.
+
+    The resamples are cut into batches of at most BATCH_POINTS points, which are fitted
+    by the pool of processes if it has more than one process. If a process of the pool
+    dies, the pool is dropped (see reset_pool) and the batches are fitted in this process.
+
+    Preconditions:
+        - the preconditions of bootstrap_band
+    """
+    batch_size = max(1, min(resamples, BATCH_POINTS // len(x)))
+    sizes = [batch_size] * (resamples // batch_size)
+    if resamples % batch_size != 0:
+        sizes.append(resamples % batch_size)
+    seeds = numpy.random.SeedSequence(seed).spawn(len(sizes))
+
+    pool = get_pool()
+    if pool is None or len(sizes) == 1:
+        results = [fit_batches(x, y, kind, weights, seeds, sizes)]
+    else:
+        # Every process gets one task of consecutive batches, so the points are sent to
+        # it only once.
+        num_tasks = min(_num_processes, len(sizes))
+        bounds = [len(sizes) * i // num_tasks for i in range(num_tasks + 1)]
+        try:
+            futures = [pool.submit(fit_batches, x, y, kind, weights, seeds[bounds[i]:bounds[i + 1]],
+                                   sizes[bounds[i]:bounds[i + 1]])
+                       for i in range(num_tasks)]
+            results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            # A process was killed, such as by the out-of-memory killer. The seeds do not
+            # depend on the processes, so the same coefficients are fitted here.
+            reset_pool(pool)
+            results = [fit_batches(x, y, kind, weights, seeds, sizes)]
+
+    return (numpy.concatenate([a for a, _ in results]),
+            numpy.concatenate([b for _, b in results]))
+
+
+def fit_batches(x: numpy.ndarray, y: numpy.ndarray, kind: str,
+                weights: Optional[numpy.ndarray], seeds: List[numpy.random.SeedSequence],
+                sizes: List[int]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Returns the coefficients a and b of the curves fitted to the resamples of the
+    given batches, in order. The batch i has sizes[i] resamples drawn from the random
+    stream of seeds[i].
+
+    Preconditions:
+        - the preconditions of bootstrap_band
+        - len(seeds) == len(sizes)
+    """
+    # Accumulators: The coefficients of the batches fitted so far.
+    a_so_far = []
+    b_so_far = []
+    for i in range(len(sizes)):
+        generator = numpy.random.default_rng(seeds[i])
+        a, b = fit_resamples(x, y, kind, weights,
+                             generator.integers(0, len(x), (sizes[i], len(x))))
+        a_so_far.append(a)
+        b_so_far.append(b)
+
+    return (numpy.concatenate(a_so_far), numpy.concatenate(b_so_far))
+
+
+def fit_resamples(x: numpy.ndarray, y: numpy.ndarray, kind: str,
+                  weights: Optional[numpy.ndarray],
+                  indices: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Returns the coefficients a and b of the curves fitted to the resamples of the
+    points whose indices are the rows of indices, all at once.
+
+    Preconditions:
+        - the preconditions of bootstrap_band
+        - indices.ndim == 2 and all(0 <= indices < len(x))
+
+    >>> x, y = numpy.array([0.0, 1.0, 2.0]), numpy.array([1.0, 3.0, 5.0])
+    >>> a, b = fit_resamples(x, y, 'linear', None, numpy.array([[0, 1, 2], [0, 2, 2]]))
+    >>> a.tolist(), b.tolist()
+    ([1.0, 1.0], [2.0, 2.0])
+    """
+    xs = x[indices]
+    ys = y[indices]
+    if kind == 'exponential':
+        # As in regression.exponential_fit, ln(y) is fitted with weights y.
+        ws = ys
+        ys = numpy.log(ys)
+    elif weights is not None:
+        ws = weights[indices]
+    else:
+        ws = None
+
+    if ws is None:
+        x_mean = xs.mean(axis=1, keepdims=True)
+        y_mean = ys.mean(axis=1, keepdims=True)
+        dx = xs - x_mean
+        sxx = numpy.einsum('ij,ij->i', dx, dx)
+        sxy = numpy.einsum('ij,ij->i', dx, ys - y_mean)
+    else:
+        w_sum = ws.sum(axis=1, keepdims=True)
+        x_mean = numpy.einsum('ij,ij->i', ws, xs)[:, numpy.newaxis] / w_sum
+        y_mean = numpy.einsum('ij,ij->i', ws, ys)[:, numpy.newaxis] / w_sum
+        wdx = ws * (xs - x_mean)
+        sxx = numpy.einsum('ij,ij->i', wdx, xs - x_mean)
+        sxy = numpy.einsum('ij,ij->i', wdx, ys - y_mean)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        b = numpy.where(sxx > 0, sxy / sxx, math.nan)
+    a = y_mean[:, 0] - b * x_mean[:, 0]
+    return (a, b)
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """Returns the pool of processes fitting the batches of bootstrap_fits, creating it
+    if needed, or None if the batches are fitted in this process."""
+    global _pool
+    with _pool_lock:
+        if _pool is None and _num_processes > 1:
+            # The pool may be created by a thread of the server, and forking a process
+            # that runs several threads is unsafe, so the processes are started by a fork
+            # server where there is one.
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods
+                                                  else None)
+            _pool = ProcessPoolExecutor(max_workers=_num_processes, mp_context=context)
+        return _pool
+
+
+def reset_pool(pool: ProcessPoolExecutor) -> None:
+    """Shut down the given broken pool, so that get_pool creates a new pool the next time
+    it is called. Nothing happens to the current pool if it is not the given pool, since
+    another thread may already have replaced it."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+    pool.shutdown(wait=False)
+
+
+def set_process_count(num_processes: int) -> None:
+    """Replace the pool of processes fitting the batches with one of num_processes
+    processes. With num_processes == 1, the batches are fitted in this process.
+
+    Preconditions:
+        - num_processes > 0
+    """
+    global _pool, _num_processes
+    with _pool_lock:
+        old_pool = _pool
+        _pool = None
+        _num_processes = num_processes
+
+    if old_pool is not None:
+        old_pool.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(config={'max-line-length': 100, 'extra-imports': ['numpy']})
@@ -0,0 +1,146 @@
+"""
+CSC110 Course Project: Air Pollution and Forestry
+=========================================================================================
+LRUCache Class
+A bounded cache shared by every session of the bokeh server, used to keep the results of
+expensive data queries.
+=========================================================================================
+@author: Tu Anh Pham
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """A thread-safe mapping with at most max_entries entries, and optionally at most
+    max_bytes bytes of values. When it is full, adding an entry evicts the least recently
+    used ones.
+
+    Instance Attributes:
+        - max_entries: The maximum number of entries in the cache.
+        - max_bytes: The maximum total size of the values in the cache, or None if the size
+        is not limited.
+        - nbytes: The total size of the values in the cache.
+        - hits: The number of lookups that found their key.
+        - misses: The number of lookups that did not find their key.
+
+    Representation Invariants:
+        - self.max_entries > 0
+        - self.max_bytes is None or self.nbytes <= self.max_bytes
+        - self.hits >= 0 and self.misses >= 0
+    """
+    # Private Instance Attributes:
+    #   - _entries: The mapping of keys to (value, size) pairs, from the least to the most
+    #   recently used.
+    #   - _sizeof: The function returning the size of a value in bytes.
+    #   - _lock: Guards _entries and the counters, since sessions may run in several threads.
+    _entries: OrderedDict
+    _sizeof: Callable[[Any], int]
+    _lock: threading.Lock
+
+    max_entries: int
+    max_bytes: Optional[int]
+    nbytes: int
+    hits: int
+    misses: int
+
+    def __init__(self, max_entries: int, max_bytes: Optional[int] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None) -> None:
+        """Initialize an empty cache.
+            - sizeof returns the size of a value in bytes. It is required when max_bytes
+            is not None.
+
+        Preconditions:
+            - max_entries > 0
+            - max_bytes is None or (max_bytes >= 0 and sizeof is not None)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._sizeof = sizeof or (lambda value: 0)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Returns the number of entries in the cache."""
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Returns whether the key is in the cache, without counting a lookup."""
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns the value of the key, or default if the key is not in the cache.
+        The key becomes the most recently used one."""
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            else:
+                self.misses += 1
+                return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Add the entry to the cache, evicting the least recently used entries if needed.
+        A value larger than max_bytes is not added."""
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            self._evict()
+
+    def resize(self, max_entries: int, max_bytes: Optional[int] = None) -> None:
+        """Change the limits of the cache, evicting the least recently used entries if
+        needed.
+
+        Preconditions:
+            - max_entries > 0
+            - max_bytes is None or max_bytes >= 0
+        """
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Returns the value of the key. If the key is not in the cache, its value is
+        computed by calling compute() and added to the cache.
+
+        compute is called without holding the lock, so two threads missing the same key
+        at the same time may both compute it; the result is the same.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+
+        return value
+
+    def clear(self) -> None:
+        """Remove every entry from the cache. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _evict(self) -> None:
+        """Evict the least recently used entries until the cache is within its limits.
+        The caller must hold _lock."""
+        while len(self._entries) > self.max_entries or \
+                (self.max_bytes is not None and self.nbytes > self.max_bytes):
+            self.nbytes -= self._entries.popitem(last=False)[1][1]
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={'max-line-length': 100})
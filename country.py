@@ -7,7 +7,11 @@ A Country instance represent a single country.
 @author: Tu Anh Pham
 """
 from __future__ import annotations
-from typing import Dict, List, Tuple, Set
+from typing import Dict, List, Optional, Tuple, Set
+
+import numpy
+
+from indicator_store import IndicatorStore, paired_values
 
 
 class Country:
@@ -24,29 +28,37 @@ class Country:
         - all(k in {'region', 'sub-region', 'int-region'} for k in region)
     """
     # Private Instance Attributes:
-    #   - _data: A dictionary with keys are indicator names and values
-    #   are dictionaries that map the recorded years with the indicated values.
+    #   - _store: The columnar store holding the data of this country. A store is
+    #   usually shared by every country of a data manager.
+    #   - _row: The row of this country in _store.
     #
     # Private Representation Invariants:
-    #   - _data != {}
-    _data: Dict[str, Dict[int, float]]
+    #   - self._store.codes[self._row] == self.code
+    _store: IndicatorStore
+    _row: int
 
     # Public Instance Attributes
     name: str
     code: str
     region: Dict[str, str]
 
-    def __init__(self, name: str, code: str, regions: Tuple[str, str, str]) -> None:
+    def __init__(self, name: str, code: str, regions: Tuple[str, str, str],
+                 store: Optional[IndicatorStore] = None) -> None:
         """Initialize the country object.
             - regions is a tuple of the region, the sub-region, and the intermediate
             region the country belongs to, respectively.
+            - store is the columnar store the data is written to. A new store is
+            created when it is None.
 
         Preconditions:
             - reg[0] != "" and reg[1] != ""
             - name != ""
             - code != ""
         """
-        self._data = {}
+        if store is None:
+            store = IndicatorStore()
+        self._store = store
+        self._row = store.add_row(code)
         self.region = {}
         self.name = name
         self.code = code
@@ -63,11 +75,7 @@ class Country:
             - len(data) > 0
             - data follows the format {year: value}.
         """
-        if indicator_name not in self._data:
-            self._data[indicator_name] = {}
-
-        for year in data:
-            self._data[indicator_name][year] = data[year]
+        self._store.set_values(indicator_name, self._row, data)
 
     def get_data_values(self, years: List[int], indicator: str) \
             -> List[float]:
@@ -76,18 +84,14 @@ class Country:
 
         Returns an empty list if there is no data in at least one year.
         """
-        if indicator not in self._data:
+        if not self._store.has_indicator(indicator) or not self._store.has_years(years):
             return []
-        # Accumulator: The list of data points.
-        data_values = []
 
-        for year in years:
-            if year in self._data[indicator]:
-                data_values.append(self._data[indicator][year])
-            else:
-                return []
+        values = self._store.values(indicator)[self._row, self._store.year_columns(years)]
+        if numpy.isnan(values).any():
+            return []
 
-        return data_values
+        return values.tolist()
 
     def get_data_points(self, years: List[int],
                         indicator1: str, indicator2: str) -> List[Tuple[float, float]]:
@@ -99,21 +103,20 @@ class Country:
             - indicator1 != '' and indicator2 != ''
             - indicator1 != indicator2
         """
-        if indicator1 not in self._data or indicator2 not in self._data:
+        if not self._store.has_indicator(indicator1) or not self._store.has_indicator(indicator2):
             return []
 
-        # Accumulator
-        points_so_far = []
-        for year in years:
-            if year in self._data[indicator1] and year in self._data[indicator2]:
-                points_so_far.append((self._data[indicator1][year], self._data[indicator2][year]))
+        cols = self._store.year_columns(years)
+        x, y = paired_values(self._store.values(indicator1)[self._row, cols],
+                             self._store.values(indicator2)[self._row, cols])
 
-        return points_so_far
+        return list(zip(x.tolist(), y.tolist()))
 
     def indicators(self) -> Set[str]:
         """Returns a set of all indicators of the data this country object currently has.
         """
-        return set(self._data.keys())
+        return {indicator for indicator in self._store.indicators()
+                if not numpy.isnan(self._store.values(indicator)[self._row]).all()}
 
 
 class NoDataException(Exception):
@@ -130,5 +133,6 @@ if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'max-line-length': 100
+        'max-line-length': 100,
+        'extra-imports': ['numpy']
     })
@@ -9,11 +9,35 @@ that can be used by the simulator. This format is described in the report.
 @author: Tu Anh Pham
 """
 import csv
-from typing import Dict, List, Set
+import difflib
+import io
+import itertools
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 import json
 
+import numpy
 
-WORLD_GEO = {}
+
+# The file of the countries of the world and the regions they belong to.
+WORLD_GEO_FILE = 'Data/country_by_region.json'
+
+# How similar (from 0 to 1) a normalized name must be to a known one to be matched to it.
+NAME_MATCH_CUTOFF = 0.9
+
+# The number of rows of a data file parsed at a time by iter_formatted_table.
+DEFAULT_CHUNK_ROWS = 10000
+
+# The tokens, other than the empty string, that mark a missing value in a data file.
+MISSING_VALUE_TOKENS = ['..']
+
+# The mapping of absolute file paths to the (size, mtime) of the files and the geographies
+# parsed from them.
+_geographies = {}
+_geographies_lock = threading.Lock()
 
 
 ##############################################################
@@ -148,22 +172,24 @@ def acag_data_combine() -> None:
         new_header = ['Country Name', 'Country Code'] + [str(year) for year in range(1990, 2020)]
         writer.writerow(new_header)
         country_data = {}
+        code_to_name = get_country_code_to_name()
         for year in range(1998, 2019):
-            add_acag_data(country_data, year)
+            add_acag_data(country_data, year, code_to_name)
 
         for row in sorted(country_data.values(), key=lambda lst: lst[0]):
             writer.writerow(row)
 
 
 # Helper
-def add_acag_data(country_data: dict, year: int) -> None:
+def add_acag_data(country_data: dict, year: int, code_to_name: Dict[str, str]) -> None:
     """Mutate the country_data dictionary, add the air pollution data of a
-    year to it."""
+    year to it.
+        - code_to_name is the mapping of country codes to country names.
+    """
     filepath = 'Data/' + str(year) + '.csv'
     with open(filepath) as file_in:
         reader = csv.reader(file_in)
         next(reader)
-        code_to_name = get_country_code_to_name()
         for row in reader:
             if row[0] not in country_data and row[0] in code_to_name:
                 country_data[row[0]] = [code_to_name[row[0]], row[0]] + \
@@ -189,12 +215,13 @@ def undp_data_convert(filepath: str) -> None:
         header = ['Country Name', 'Country Code'] + [str(year) for year in range(1990, 2019)]
         writer.writerow(header)
 
-        name_to_code = get_country_name_to_code()
+        geography = get_world_geography()
         for row in reader:
-            if row[1] in name_to_code:
+            code = geography.find_code(row[1])
+            if code is not None:
                 # Extract the data from 1990 to 2018
                 # and remove the blank columns that separate entries in to original file.
-                new_row = [row[1], name_to_code[row[1]]] + [row[i * 2] for i in range(1, 30)]
+                new_row = [row[1], code] + [row[i * 2] for i in range(1, 30)]
                 writer.writerow(new_row)
 
 
@@ -215,12 +242,12 @@ def neci_tsv_data_convert(filepath: str) -> None:
         header = ['Country Name', 'Country Code'] + [str(y) for y in range(1990, 2021)]
         writer.writerow(header)
 
-        name_to_code = get_country_name_to_code()
+        geography = get_world_geography()
         # Accumulator: The dictionary mapping country names to dictionaries of years to volcanic
         # eruption counts
         country_to_data = {}
         for row in reader:
-            if row[8] in name_to_code:  # row[8] is the country name.
+            if geography.find_code(row[8]) is not None:  # row[8] is the country name.
                 if row[8] not in country_to_data:
                     # Create an accumulator: a mapping of year to eruption counts
                     country_to_data[row[8]] = {year: 0 for year in range(1990, 2021)}
@@ -229,7 +256,7 @@ def neci_tsv_data_convert(filepath: str) -> None:
         # Write data to the new file:
         for name in country_to_data:
             data_by_year = [str(country_to_data[name][year]) for year in range(1990, 2021)]
-            new_row = [name, name_to_code[name]] + data_by_year
+            new_row = [name, geography.find_code(name)] + data_by_year
             writer.writerow(new_row)
 
 
@@ -249,10 +276,11 @@ def open_ei_data_convert(filepath: str) -> None:
         header.insert(1, 'Country Code')
         writer.writerow(header)
 
-        name_to_code = get_country_name_to_code()
+        geography = get_world_geography()
         for row in reader:
-            if row[0] in name_to_code:
-                row.insert(1, name_to_code[row[0]])
+            code = geography.find_code(row[0])
+            if code is not None:
+                row.insert(1, code)
                 writer.writerow(row)
 
 
@@ -275,7 +303,8 @@ def iea_data_convert(filepath: str) -> None:
         new_header = ['Country Name', 'Country Code'] + [str(y) for y in range(1990, 2021)]
         writer.writerow(new_header)
 
-        name_to_code = get_country_name_to_code()
+        # The country names are the columns of the header.
+        name_to_code = get_world_geography().match_names(header[1:])
         # Accumulator: The dictionary mapping country names to list of data values from 1990 to 2020
         country_to_data = {}
         for row in reader:
@@ -318,33 +347,145 @@ def create_world_geo_from_json(filepath: str) -> Dict[str, Dict[str, str]]:
     return countries_so_far
 
 
-def create_region_group_data() -> Dict[str, Dict[str, Set[str]]]:
-    """Returns a mapping of region types (e.g. 'region', 'sub-region', 'int-region') to the
-    dictionaries of regions in those region types to sets of country alpha-3 codes.
-    e.g: {'region': {'Asia': {JPN, CHN}}, 'sub-region': {}, 'int-region': {}}
+class WorldGeography:
+    """The geographical information of the countries of the world, parsed from one
+    json file. A geography is shared by every caller of get_world_geography, so none of its
+    attributes may be mutated.
+
+    Instance Attributes:
+        - countries: The mapping of alpha-3 country codes to the country information
+        returned by create_world_geo_from_json: {'name', 'region', 'sub-region', 'int-region'}.
+        - code_to_name: The mapping of country codes to country names.
+        - name_to_code: The mapping of country names to country codes.
+        - region_groups: The mapping of region types (e.g. 'region', 'sub-region',
+        'int-region') to dictionaries of region names to sets of country codes.
+        e.g: {'region': {'Asia': {JPN, CHN}}, 'sub-region': {}, 'int-region': {}}
+
+    Representation Invariants:
+        - all(self.name_to_code[self.code_to_name[code]] == code for code in self.countries)
+    """
+    # Private Instance Attributes:
+    #   - _normalized_to_code: The mapping of normalized country names (see
+    #   normalize_country_name) to country codes.
+    #   - _matches: The memo of find_code, mapping the names that were looked up to their
+    #   country codes, or None if they did not match any country.
+    _normalized_to_code: Dict[str, str]
+    _matches: Dict[str, Optional[str]]
+
+    countries: Dict[str, Dict[str, str]]
+    code_to_name: Dict[str, str]
+    name_to_code: Dict[str, str]
+    region_groups: Dict[str, Dict[str, Set[str]]]
+
+    def __init__(self, countries: Dict[str, Dict[str, str]]) -> None:
+        """Initialize the geography from the mapping of country codes to country
+        information returned by create_world_geo_from_json."""
+        self.countries = countries
+        self.code_to_name = {code: countries[code]['name'] for code in countries}
+        self.name_to_code = {countries[code]['name']: code for code in countries}
+        self._normalized_to_code = {normalize_country_name(name): code
+                                    for name, code in self.name_to_code.items()}
+        self._matches = {}
+
+        # Accumulator: The mapping of region types to region dictionaries.
+        self.region_groups = {'region': {}, 'sub-region': {}, 'int-region': {}}
+        for code in countries:
+            for region_type in self.region_groups:
+                region = countries[code][region_type]
+                if region not in self.region_groups[region_type]:
+                    self.region_groups[region_type][region] = set()
+                self.region_groups[region_type][region].add(code)
+
+    def find_code(self, name: str) -> Optional[str]:
+        """Returns the code of the country with the given name, or None if there is none.
+
+        The data sources do not spell country names the same way, so a name that is not
+        found as is is normalized (see normalize_country_name) and then matched against
+        the closest normalized name, if one is close enough. The results are memoized.
+
+        >>> geo = WorldGeography({'KOR': {'name': 'Korea, Republic of', 'region': 'Asia',
+        ...                               'sub-region': 'Eastern Asia', 'int-region': ''}})
+        >>> geo.find_code('Republic of Korea')
+        'KOR'
+        >>> geo.find_code('Korea, Repulic of') is None
+        False
+        >>> geo.find_code('France') is None
+        True
+        """
+        if name in self.name_to_code:
+            return self.name_to_code[name]
+
+        if name not in self._matches:
+            key = normalize_country_name(name)
+            code = self._normalized_to_code.get(key)
+            if code is None:
+                close_keys = difflib.get_close_matches(key, self._normalized_to_code.keys(),
+                                                       n=1, cutoff=NAME_MATCH_CUTOFF)
+                if close_keys:
+                    code = self._normalized_to_code[close_keys[0]]
+            self._matches[name] = code
+
+        return self._matches[name]
+
+    def match_names(self, names: List[str]) -> Dict[str, str]:
+        """Returns the mapping of the given names to country codes (see find_code).
+        Names that do not match any country are left out."""
+        # Accumulator: The mapping of names to codes.
+        table_so_far = {}
+        for name in names:
+            code = self.find_code(name)
+            if code is not None:
+                table_so_far[name] = code
+
+        return table_so_far
+
+
+def get_world_geography(filepath: str = WORLD_GEO_FILE) -> WorldGeography:
+    """Returns the geography parsed from the given json file.
+    The file is parsed on the first call only; later calls return the same object, until
+    the file is modified.
     """
-    world_map = create_world_geo_from_json('Data/country_by_region.json')
+    key = os.path.abspath(filepath)
+    stat = os.stat(filepath)
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    with _geographies_lock:
+        if key not in _geographies or _geographies[key][0] != stamp:
+            _geographies[key] = (stamp, WorldGeography(create_world_geo_from_json(filepath)))
 
-    # Accumulator: The mapping of region types to region dictionaries.
-    regions_so_far = {'region': {}, 'sub-region': {}, 'int-region': {}}
+        return _geographies[key][1]
 
-    for country_code in world_map:
-        country_reg = world_map[country_code]['region']
-        country_sub_reg = world_map[country_code]['sub-region']
-        country_int_reg = world_map[country_code]['int-region']
 
-        if country_reg not in regions_so_far['region']:
-            regions_so_far['region'][country_reg] = set()
-        if country_sub_reg not in regions_so_far['sub-region']:
-            regions_so_far['sub-region'][country_sub_reg] = set()
-        if country_int_reg not in regions_so_far['int-region']:
-            regions_so_far['int-region'][country_int_reg] = set()
+def clear_world_geography() -> None:
+    """Forget every parsed geography and its lookup tables, so that the next call to
+    get_world_geography parses its file again."""
+    with _geographies_lock:
+        _geographies.clear()
 
-        set.add(regions_so_far['region'][country_reg], country_code)
-        set.add(regions_so_far['sub-region'][country_sub_reg], country_code)
-        set.add(regions_so_far['int-region'][country_int_reg], country_code)
 
-    return regions_so_far
+def normalize_country_name(name: str) -> str:
+    """Returns the normalized form of a country name, which ignores case, accents,
+    punctuation, the words 'the', 'of' and 'and', and the order of the words.
+
+    >>> normalize_country_name("Korea, Rep. of the")
+    'korea rep'
+    >>> normalize_country_name('C\\u00f4te d\\u2019Ivoire')
+    'cote d ivoire'
+    """
+    name = ''.join(char for char in unicodedata.normalize('NFKD', name)
+                   if not unicodedata.combining(char))
+    name = name.lower().replace('&', ' and ')
+    words = re.sub('[^a-z0-9]+', ' ', name).split()
+    return ' '.join(sorted(word for word in words if word not in {'the', 'of', 'and'}))
+
+
+def create_region_group_data(filepath: str = WORLD_GEO_FILE) -> Dict[str, Dict[str, Set[str]]]:
+    """Returns a mapping of region types (e.g. 'region', 'sub-region', 'int-region') to the
+    dictionaries of regions in those region types to sets of country alpha-3 codes.
+    e.g: {'region': {'Asia': {JPN, CHN}}, 'sub-region': {}, 'int-region': {}}
+
+    The returned mapping is shared (see get_world_geography) and must not be mutated.
+    """
+    return get_world_geography(filepath).region_groups
 
 
 def read_formatted_row(row: List[str], header: List[str]) -> Dict[int, float]:
@@ -366,13 +507,204 @@ def read_formatted_row(row: List[str], header: List[str]) -> Dict[int, float]:
     return row_data
 
 
+def read_formatted_table(filepath: str) -> Tuple[List[str], List[str], List[int], numpy.ndarray]:
+    """Reads a data file in the format described in the report.
+    Returns a tuple of the country names, the country codes, the years, and the
+    (countries x years) float array of data values. Missing values are NaN.
+
+    Preconditions:
+        - the file follows the format described in the report.
+    """
+    # Accumulators: The tables of the chunks of the file.
+    names = []
+    codes = []
+    blocks = []
+    years = read_formatted_header(filepath)[0]
+    for table, _ in iter_formatted_table(filepath):
+        names.extend(table[0])
+        codes.extend(table[1])
+        blocks.append(table[3])
+
+    if blocks == []:
+        return (names, codes, years, numpy.empty((0, len(years))))
+
+    return (names, codes, years, numpy.concatenate(blocks))
+
+
+def iter_formatted_table(filepath: str, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                         start_offset: Optional[int] = None) \
+        -> Iterator[Tuple[Tuple[List[str], List[str], List[int], numpy.ndarray], int]]:
+    """Reads a data file in the format described in the report, chunk_rows rows at a time.
+    Yields (table, offset) pairs, where table is a tuple like the one returned by
+    read_formatted_table, with the rows of one chunk, and offset is the position in the
+    file right after the chunk.
+
+    Only one chunk is in memory at a time, so files of any size can be read, and the
+    chunks can be aggregated while the rest of the file is still being read. Reading can
+    be stopped after any chunk and resumed later by passing the last offset as
+    start_offset. With start_offset None, the file is read from its first data row.
+
+    Preconditions:
+        - the file follows the format described in the report.
+        - chunk_rows > 0
+        - start_offset is None or start_offset was yielded for this file.
+    """
+    years, year_cols, num_cols, header_end = read_formatted_header(filepath)
+
+    with open(filepath, 'rb') as file:
+        file.seek(header_end if start_offset is None else start_offset)
+        while True:
+            # Unlike a text file, a binary file keeps file.tell() usable while iterating.
+            lines = list(itertools.islice(file, chunk_rows))
+            table = parse_formatted_chunk(b''.join(lines), years, year_cols, num_cols)
+            if table[0] != []:
+                yield (table, file.tell())
+            if len(lines) < chunk_rows:
+                return
+
+
+def read_formatted_header(filepath: str) -> Tuple[List[int], Dict[int, int], int, int]:
+    """Reads the header of a data file in the format described in the report.
+    Returns a tuple of the sorted years, the mapping of the indices of the year columns of
+    the file to the indices of their years, the number of columns, and the position in the
+    file right after the header.
+
+    Preconditions:
+        - the file follows the format described in the report.
+    """
+    with open(filepath, 'rb') as file:
+        line = file.readline()
+        header = next(csv.reader([line.decode('utf-8-sig')]))
+        header_end = file.tell()
+
+    # Accumulator: The mapping of the year columns of the file to their years.
+    col_to_year = {}
+    for i in range(2, len(header)):
+        try:
+            col_to_year[i] = int(header[i])
+        except ValueError:
+            continue    # not a year column
+
+    years = sorted(set(col_to_year.values()))
+    year_to_col = {year: i for i, year in enumerate(years)}
+    return (years, {i: year_to_col[col_to_year[i]] for i in col_to_year}, len(header),
+            header_end)
+
+
+def parse_formatted_chunk(data: bytes, years: List[int], year_cols: Dict[int, int],
+                          num_cols: int) -> Tuple[List[str], List[str], List[int], numpy.ndarray]:
+    """Returns the table of the given lines of a data file, like read_formatted_table.
+    Blank lines are skipped.
+        - data is the lines, as read from the file.
+        - years, year_cols, and num_cols are the sorted years, the mapping of the indices
+        of the year columns to the indices of their years, and the number of columns, as
+        returned by read_formatted_header.
+
+    The whole chunk is read at once by numpy.loadtxt, once its missing cells are filled in
+    (see fill_missing_cells). If a line does not have num_cols cells, or a cell is neither
+    missing nor a number that loadtxt can read, the chunk is parsed cell by cell by
+    parse_formatted_rows instead, so the result is the same either way.
+    """
+    if data == b'' or data.isspace():
+        return ([], [], years, numpy.empty((0, len(years))))
+
+    table = None
+    # A year with several columns gets the last of their values that can be read, which
+    # is only known cell by cell.
+    if num_cols > 2 and len(set(year_cols.values())) == len(year_cols):
+        dtype = numpy.dtype([('name', object), ('code', object),
+                             ('values', numpy.float64, (num_cols - 2,))])
+        try:
+            table = numpy.loadtxt(io.BytesIO(fill_missing_cells(data)), dtype=dtype,
+                                  delimiter=',', quotechar='"', comments=None, encoding='utf-8',
+                                  ndmin=1)
+        except ValueError:
+            table = None
+
+    # Filling in the missing cells also fills the empty cells of a quoted name or of a
+    # code, so a chunk with a name or code that now contains 'nan' is read again cell by
+    # cell.
+    if table is None or 'nan' in '\n'.join(itertools.chain(table['name'], table['code'])):
+        rows = csv.reader(io.StringIO(data.decode('utf-8'), newline=''))
+        return parse_formatted_rows([row for row in rows if len(row) >= 2], years, year_cols)
+
+    values = table['values']
+    if all(year_cols.get(col) == col - 2 for col in range(2, num_cols)):
+        block = numpy.array(values)  # The common case: one column per year, in order.
+    else:
+        block = numpy.full((len(table), len(years)), numpy.nan)
+        for col in year_cols:
+            block[:, year_cols[col]] = values[:, col - 2]
+
+    return (table['name'].tolist(), table['code'].tolist(), years, block)
+
+
+def fill_missing_cells(data: bytes) -> bytes:
+    """Returns the given lines of a data file, with 'nan' in every missing cell that is
+    not the first cell of its line: every cell that is blank, or a missing value token.
+    The last line is also ended with a newline.
+
+    The lines are not parsed, so the empty cells inside a quoted cell, like "a,,b", are
+    filled in as well.
+
+    >>> fill_missing_cells(b'a,b,,1,..,\\r\\nc,d,..,,2')
+    b'a,b,nan,1,nan,nan\\r\\nc,d,nan,nan,2\\n'
+    """
+    if not data.endswith(b'\n'):
+        data += b'\n'
+
+    chars = numpy.frombuffer(data, dtype=numpy.uint8)
+    ends = numpy.flatnonzero((chars == ord(',')) | (chars == ord('\r')) | (chars == ord('\n')))
+    # The start and length of every cell that follows a comma.
+    after_comma = chars[ends[:-1]] == ord(',')
+    starts = ends[:-1][after_comma] + 1
+    lengths = ends[1:][after_comma] - starts
+
+    missing = lengths == 0
+    for token in MISSING_VALUE_TOKENS:
+        is_token = lengths == len(token)
+        for i, char in enumerate(token.encode('utf-8')):
+            # The cells are followed by a delimiter, so starts + i is within chars.
+            is_token &= chars[numpy.minimum(starts + i, len(chars) - 1)] == char
+        missing |= is_token
+
+    # The data between the missing cells, joined by 'nan'.
+    cell_starts = starts[missing].tolist()
+    cell_ends = (starts + lengths)[missing].tolist()
+    return b'nan'.join([data[start:end] for start, end in zip([0] + cell_ends,
+                                                              cell_starts + [len(data)])])
+
+
+def parse_formatted_rows(rows: List[List[str]], years: List[int], year_cols: Dict[int, int]) \
+        -> Tuple[List[str], List[str], List[int], numpy.ndarray]:
+    """Returns the table of the given rows of a data file, like read_formatted_table.
+        - years and year_cols are the sorted years and the mapping of the indices of the
+        year columns to the indices of their years, as returned by read_formatted_header.
+
+    Preconditions:
+        - all(len(row) >= 2 for row in rows)
+    """
+    names = [row[0] for row in rows]
+    codes = [row[1] for row in rows]
+    block = numpy.full((len(rows), len(years)), numpy.nan)
+    for i in range(len(rows)):
+        row = rows[i]
+        for col in range(2, len(row)):
+            if col in year_cols:
+                try:
+                    block[i, year_cols[col]] = float(row[col])
+                except ValueError:
+                    continue    # not adding the invalid value and keep looping
+
+    return (names, codes, years, block)
+
+
 def read_national_master_data(filepath: str) -> Dict[str, str]:
     """Reads the csv file from National Master.
     Returns a mapping of country code to the number of motor vehicles per
     1000 inhabitants in year 2014 (the numbers are in str form: "<float_value>").
     """
-    # Table of country name to code to look up
-    name_to_code = get_country_name_to_code()
+    geography = get_world_geography()
     # Accumulator: The mapping of country code to number of motor vehicle /1000 people
     # in 2014 only.
     vehicle_data = {}
@@ -382,8 +714,8 @@ def read_national_master_data(filepath: str) -> Dict[str, str]:
         next(reader)
 
         for row in reader:
-            if row[0] in name_to_code:
-                code = name_to_code[row[0]]
+            code = geography.find_code(row[0])
+            if code is not None:
                 vehicle_data[code] = str(float(row[1].replace(',', '')))
 
     return vehicle_data
@@ -406,37 +738,20 @@ def add_iea_data_year(year: int, row: List[str], header: List[str],
 def get_country_code_to_name() -> Dict[str, str]:
     """Returns a dictionary mapping country codes to country names.
 
-    Preconditions:
-        - world_geo is not None
+    The returned dictionary is shared (see get_world_geography) and must not be mutated.
     """
-    global WORLD_GEO
-    # Accumulator: The mapping of country code to country name
-    code_to_name = {}
-
-    for code in WORLD_GEO:
-        code_to_name[code] = WORLD_GEO[code]['name']
-
-    return code_to_name
+    return get_world_geography().code_to_name
 
 
 def get_country_name_to_code() -> Dict[str, str]:
     """Returns a dictionary mapping country names to country codes.
 
-    Preconditions:
-        - world_geo is not None
+    The returned dictionary is shared (see get_world_geography) and must not be mutated.
     """
-    global WORLD_GEO
-    # Accumulator: The mapping of country name to country code
-    name_to_code = {}
-
-    for code in WORLD_GEO:
-        name_to_code[WORLD_GEO[code]['name']] = code
-
-    return name_to_code
+    return get_world_geography().name_to_code
 
 
 if __name__ == '__main__':
-    WORLD_GEO = create_world_geo_from_json('Data/country_by_region.json')
     import python_ta
 
     python_ta.check_all(config={'max-line-length': 100})
@@ -6,50 +6,114 @@ The data manager is responsible for loading, storing, and providing data for oth
 =========================================================================================
 @author: Tu Pham
 """
-import csv
-from typing import Dict, Set, Optional, List, Tuple, Any
+from __future__ import annotations
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, Set, Optional, List, Tuple, Any
+
+import numpy
 
 import data_extract
+import metrics
+import regression
+import snapshot
+from cache import LRUCache
 from country import Country
+from indicator_store import IndicatorStore, paired_values, valid_rows
+
+# The name of the file of country names written by DataManager.save_dataset.
+DATASET_COUNTRIES_FILE = 'countries.json'
+
+# The data versions given to data managers (see DataManager.version).
+_versions = itertools.count(1)
+
+# The gapminder frames computed by DataManager.get_gapminder_frames, for all data managers.
+GAPMINDER_CACHE = LRUCache(32)
+metrics.register_cache('gapminder', GAPMINDER_CACHE)
+
+# The correlation matrices computed by DataManager.correlation_matrix, for all data managers.
+CORRELATION_CACHE = LRUCache(64)
+metrics.register_cache('correlation', CORRELATION_CACHE)
+
+# The methods of DataManager.correlation_matrix and the functions computing them.
+CORRELATION_METHODS = {'pearson': regression.pearson_matrix,
+                       'spearman': regression.spearman_matrix}
 
 
 class DataManager:
     """The data manager class, responsible for storing, manipulating, and presenting data.
 
+    Instance Attributes:
+        - load_timings: The mapping of the files loaded when the manager was initialized
+        to the number of seconds taken to read each of them.
+        - version: A number identifying the data currently loaded. It is unique within the
+        process and changes every time data is loaded, so it can be used in cache keys.
     """
     # Private Instance Attributes:
     #   - _countries: the mapping of country codes to Country objects.
+    #   - _store: the columnar store holding the data of every country in _countries.
+    #   Every Country object in _countries is a view of one row of _store.
+    #   - _geography: the shared geography of the countries and regions of the world.
     #   - regional_groups, a mapping of types of region (e.g. 'region', 'sub-region'..) to
     #   dictionaries of region names and set of country codes.
     #   e.g: _regional_groups = {'region': {'Asia': {JPN, CHN}}, 'sub-region': {}, 'int-region': {}}
     #   - _indicators: The set of all indicators of the data the simulator is currently possess.
+    #   - _region_masks: a mapping of region types to dictionaries of region names and
+    #   boolean masks over the rows of _store, which are True for the countries of the region.
+    #   The masks are rebuilt whenever data is loaded.
+    #   - _frozen: Whether the manager is read-only. A frozen manager is shared between
+    #   sessions of the bokeh server, so no more data can be loaded into it.
 
     # Private Representation Invariants:
     #   - _countries != {}
     #   - _indicators != Set()
     #   - regional_groups != {}
     _countries: Dict[str, Country]
+    _store: IndicatorStore
+    _geography: data_extract.WorldGeography
     _indicators: Set[str]
     _regional_groups: Dict[str, Dict[str, Set[str]]]
+    _region_masks: Dict[str, Dict[str, numpy.ndarray]]
+    _frozen: bool
+
+    load_timings: Dict[str, float]
+    version: int
 
-    def __init__(self, air_filepath: str) -> None:
+    def __init__(self, air_filepath: str,
+                 geo_filepath: str = data_extract.WORLD_GEO_FILE,
+                 indicator_files: Optional[List[Tuple[str, str]]] = None) -> None:
         """Initialize the simulator.
 
         The PM2.5 air pollution data file is required to initialize.
-        Other data can be added later on.
+        Other data can be added later on, or given in indicator_files as a list of
+        (file path, indicator name) pairs to be loaded in parallel with the air pollution
+        data (see load_files).
+        geo_filepath is the json file of the countries and the regions they belong to.
 
         Preconditions:
             - The data file follows the format described in the report.
         """
         self._countries = {}
+        self._store = IndicatorStore()
         self._indicators = set()
-        self._regional_groups = data_extract.create_region_group_data()
-        self.load_data(air_filepath, 'air pollution')
+        self._frozen = False
+        self._geography = data_extract.get_world_geography(geo_filepath)
+        self._regional_groups = self._geography.region_groups
+        self._region_masks = {}
+        self.load_timings = self.load_files([(air_filepath, 'air pollution')] +
+                                            (indicator_files or []))
 
     def load_data(self, filepath: str, indicator_name: str) -> bool:
         """Load the data file into the simulator to populate the _countries
         dictionary.
         Add any new indicator into the set self._indicators.
+        The parsed file is cached as a binary snapshot (see snapshot.py), so loading the
+        same file again does not parse its text.
 
         Returns whether if the data handling process is successful.
 
@@ -58,27 +122,190 @@ class DataManager:
             - indicator_name != ''
             - indicator_name == indicator_name.lower()
         """
+        if self._frozen:
+            raise FrozenManagerException
+
+        with metrics.timed('load_data'):
+            self._add_table(snapshot.load_formatted_table(filepath), indicator_name)
+            self._update_region_masks()
+        self.version = next(_versions)
+        return True
 
-        with open(filepath) as file:
-            reader = csv.reader(file)
+    def stream_data(self, filepath: str, indicator_name: str,
+                    chunk_rows: int = data_extract.DEFAULT_CHUNK_ROWS,
+                    start_offset: Optional[int] = None) -> Iterator[int]:
+        """Load the data file into the simulator like load_data, chunk_rows rows at a time.
+        This is a generator: the file is read as the generator is iterated, and after each
+        chunk is added to the manager, the position in the file right after the chunk is
+        yielded.
 
-            header = next(reader)
-            world_map = data_extract.create_world_geo_from_json('Data/country_by_region.json')
-            for row in reader:
-                code = row[1]
+        Only one chunk of the file is in memory at a time, so this is meant for files too
+        large to be parsed at once. The loading can be interrupted by not iterating any
+        further, and resumed by calling stream_data again with the last yielded offset as
+        start_offset. The file is not cached as a snapshot.
+
+        Preconditions:
+            - indicator_name != ''
+            - indicator_name == indicator_name.lower()
+            - chunk_rows > 0
+            - start_offset is None or start_offset was yielded for this file.
+        """
+        if self._frozen:
+            raise FrozenManagerException
+
+        for table, offset in data_extract.iter_formatted_table(filepath, chunk_rows,
+                                                               start_offset):
+            num_rows = len(self._store)
+            self._add_table(table, indicator_name)
+            if len(self._store) != num_rows:
+                self._update_region_masks()
+            self.version = next(_versions)
+            yield offset
+
+    def load_files(self, files: List[Tuple[str, str]], max_workers: Optional[int] = None,
+                   use_processes: bool = True) -> Dict[str, float]:
+        """Load the given (file path, indicator name) pairs, like calling load_data on each
+        of them in order.
+
+        The files are independent, so they are read in parallel by a pool of max_workers
+        processes (or threads, if use_processes is False), and then merged into the
+        manager in one step. max_workers defaults to one per file, up to the number of CPUs.
+        With max_workers == 1, the files are read one after another in this process.
+
+        Returns a mapping of each file path to the number of seconds taken to read it.
+
+        Preconditions:
+            - all(indicator == indicator.lower() and indicator != '' for _, indicator in files)
+        """
+        if self._frozen:
+            raise FrozenManagerException
 
-                if code not in self._countries and code in world_map:
-                    name = row[0]
-                    region = world_map[code]['region']
-                    sub_reg = world_map[code]['sub-region']
-                    int_reg = world_map[code]['int-region']
-                    self._countries[code] = Country(name, code, (region, sub_reg, int_reg))
-                if code in world_map:
-                    country_data = data_extract.read_formatted_row(row, header)
-                    self._countries[code].add_data(indicator_name, country_data)
+        filepaths = [filepath for filepath, _ in files]
+        if max_workers is None:
+            max_workers = min(len(files), os.cpu_count() or 1)
 
+        if max_workers <= 1 or len(files) <= 1:
+            results = [_timed_read(filepath) for filepath in filepaths]
+        else:
+            if use_processes:
+                # Files may be reloaded by a thread of the server, and forking a process
+                # that runs several threads is unsafe, so the processes are started by a
+                # fork server where there is one.
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods
+                                                      else None)
+                executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+            else:
+                executor = ThreadPoolExecutor(max_workers=max_workers)
+            with executor:
+                results = list(executor.map(_timed_read, filepaths))
+
+        # Accumulator: The mapping of file paths to their reading times.
+        timings_so_far = {}
+        with metrics.timed('merge_files'):
+            for i in range(len(files)):
+                table, seconds = results[i]
+                self._add_table(table, files[i][1])
+                timings_so_far[files[i][0]] = seconds
+                metrics.STAGE_SECONDS.observe('read_file', seconds)
+                metrics.FILE_READ_SECONDS.observe(os.path.basename(files[i][0]), seconds)
+
+            self._update_region_masks()
+        self.version = next(_versions)
+        return timings_so_far
+
+    def _add_table(self, table: Tuple[List[str], List[str], List[int], numpy.ndarray],
+                   indicator_name: str) -> None:
+        """Add the data of a table returned by data_extract.read_formatted_table to the
+        store, under the given indicator name. The region masks are not updated."""
+        names, codes, years, block = table
+        world_map = self._geography.countries
+
+        # Accumulators: The rows of the file and the rows of the store they are written to.
+        file_rows = []
+        store_rows = []
+        for i in range(len(codes)):
+            code = codes[i]
+            if code not in self._countries and code in world_map:
+                region = world_map[code]['region']
+                sub_reg = world_map[code]['sub-region']
+                int_reg = world_map[code]['int-region']
+                self._countries[code] = Country(names[i], code, (region, sub_reg, int_reg),
+                                                self._store)
+            if code in world_map:
+                file_rows.append(i)
+                store_rows.append(self._store.row_of(code))
+
+        self._store.set_block(indicator_name, numpy.array(store_rows, dtype=numpy.int64),
+                              years, block[file_rows])
         self._indicators.add(indicator_name)
-        return True
+
+    def _update_region_masks(self) -> None:
+        """Rebuild the region masks over the current rows of _store."""
+        self._region_masks = {}
+        for region_type in self._regional_groups:
+            self._region_masks[region_type] = {}
+            for region, codes in self._regional_groups[region_type].items():
+                mask = numpy.zeros(len(self._store), dtype=bool)
+                mask[self._store.rows_of(codes)] = True
+                self._region_masks[region_type][region] = mask
+
+    def save_dataset(self, folder: str) -> None:
+        """Save the loaded data into the given folder, so that it can be memory-mapped
+        by DataManager.open_dataset.
+
+        The data is written to a temporary folder that is then renamed, so a folder that
+        exists is always complete. If another process created the folder first, its
+        dataset is kept.
+        """
+        temp_folder = folder + '.' + str(os.getpid()) + '.tmp'
+        self._store.save(temp_folder)
+        with open(os.path.join(temp_folder, DATASET_COUNTRIES_FILE), 'w') as file:
+            json.dump({code: self._countries[code].name for code in self._countries}, file)
+
+        try:
+            os.rename(temp_folder, folder)
+        except OSError:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+            if not os.path.isdir(folder):
+                raise
+
+    @classmethod
+    def open_dataset(cls, folder: str,
+                     geo_filepath: str = data_extract.WORLD_GEO_FILE) -> DataManager:
+        """Returns a frozen data manager whose data arrays are memory-mapped from the given
+        folder, which was written by save_dataset.
+        geo_filepath is the json file of the countries and the regions they belong to.
+
+        Every process that opens the same folder shares the data arrays instead of holding
+        its own copy.
+        """
+        manager = cls.__new__(cls)
+        manager._store = IndicatorStore.open(folder)
+        manager._indicators = manager._store.indicators()
+        manager._geography = data_extract.get_world_geography(geo_filepath)
+        manager._regional_groups = manager._geography.region_groups
+        manager._frozen = True
+        manager.load_timings = {}
+
+        with open(os.path.join(folder, DATASET_COUNTRIES_FILE)) as file:
+            names = json.load(file)
+        world_map = manager._geography.countries
+        manager._countries = {}
+        for code in manager._store.codes:
+            regions = (world_map[code]['region'], world_map[code]['sub-region'],
+                       world_map[code]['int-region'])
+            manager._countries[code] = Country(names[code], code, regions, manager._store)
+        manager._update_region_masks()
+        manager.version = next(_versions)
+
+        return manager
+
+    def freeze(self) -> None:
+        """Make the manager read-only. Loading data into a frozen manager raises
+        FrozenManagerException."""
+        self._frozen = True
+        self._store.freeze()
 
     def get_gapminder_data_from_regions(self, years: List[int], *indicators: str,
                                         region_type: Optional[str] = 'region',
@@ -99,23 +326,67 @@ class DataManager:
             - all(region in self._regional_groups[region_type] for region in regions)
             - regions can be all sub-regions or all regions, but cannot be mixed.
         """
-        indicators = list(indicators) + ['name', 'region']
         # Accumulator
-        data = {year: {indicator: [] for indicator in indicators} for year in years}
+        data = {year: {indicator: [] for indicator in list(indicators) + ['name', 'region']}
+                for year in years}
         if regions is None:     # then get the data of the whole world.
             regions = set(reg for reg in self._regional_groups[region_type])
 
-        for region in regions:
-            for country_code in self._regional_groups[region_type][region]:
-                if country_code in self._countries:
-                    update_gapminder_data(data, years, self._countries[country_code],
-                                          region_type, *indicators)
+        if all(self._store.has_indicator(ind) for ind in indicators) \
+                and self._store.has_years(years):
+            cols = self._store.year_columns(years)
+            for region in regions:
+                rows = numpy.flatnonzero(self._region_masks[region_type][region])
+                update_gapminder_data(data, years, region,
+                                      [self._countries[self._store.codes[row]].name
+                                       for row in rows],
+                                      {ind: self._store.values(ind)[rows][:, cols]
+                                       for ind in indicators})
 
         if not data[years[0]]['population']:
             raise NoDataPointsException
 
         return data
 
+    def get_gapminder_frames(self, years: List[int], *indicators: str,
+                             region_type: Optional[str] = 'region',
+                             regions: Optional[Set[str]] = None) -> \
+            Dict[int, Dict[str, Any]]:
+        """Returns the same data as get_gapminder_data_from_regions, from a cache shared by
+        every data manager of the process. The indicator values are read-only float64 arrays
+        instead of lists, so bokeh can send them to the browser as binary buffers.
+
+        Every year has the same countries in the same order, so the 'name' and 'region'
+        lists are the same objects in every year.
+
+        The cache is keyed by the data version, the years, the indicators, the region type
+        and the regions, so every combination is computed once per version of the data.
+        The returned dictionary is shared and must not be mutated.
+
+        Preconditions:
+            - the same as get_gapminder_data_from_regions.
+        """
+        key = (self.version, tuple(years), indicators, region_type,
+               None if regions is None else frozenset(regions))
+
+        def compute() -> Dict[int, Dict[str, Any]]:
+            """Compute the frames and convert their indicator values to arrays."""
+            data = self.get_gapminder_data_from_regions(years, *indicators,
+                                                        region_type=region_type,
+                                                        regions=regions)
+            names = data[years[0]]['name']
+            regions_of_names = data[years[0]]['region']
+            frames = {}
+            for year in years:
+                frames[year] = {'name': names, 'region': regions_of_names}
+                for indicator in indicators:
+                    frames[year][indicator] = numpy.array(data[year][indicator],
+                                                          dtype=numpy.float64)
+                    frames[year][indicator].flags.writeable = False
+            return frames
+
+        return GAPMINDER_CACHE.get_or_compute(key, compute)
+
     def get_data_points(self, years: List[int], indicator1: str, indicator2: str,
                         region: Optional[str] = None) -> List[Tuple[float, float]]:
         """Returns the list of data points of the given years with the given indicators.
@@ -129,23 +400,189 @@ class DataManager:
             - region is None or region in self_regional_group['region'] or \
             region in self_regional_group['sub-region']
         """
-        # Accumulator
-        data_so_far = []
-        if region is None:
-            for country in self._countries.values():
-                data_so_far += country.get_data_points(years, indicator1, indicator2)
-        elif region in self._regional_groups['region']:
-            for code in self._regional_groups['region'][region]:
-                if code in self._countries:
-                    data_so_far += self._countries[code].get_data_points(years, indicator1,
-                                                                         indicator2)
-        else:
-            for code in self._regional_groups['sub-region'][region]:
-                if code in self._countries:
-                    data_so_far += self._countries[code].get_data_points(years, indicator1,
-                                                                         indicator2)
+        x, y = self._query_arrays(self._store.year_columns(years), indicator1, indicator2,
+                                  region)
+        return list(zip(x.tolist(), y.tolist()))
+
+    def get_data_arrays(self, start_year: int, end_year: int, indicator1: str, indicator2: str,
+                        region: Optional[str] = None) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Returns the x- and y-coordinates of the data points from start_year to end_year
+        (inclusive) with the given indicators, as two arrays of the same length.
+        This returns the same points as get_data_points, without building a list of tuples.
 
-        return data_so_far
+        Returns two empty arrays if there's no data.
+
+        Preconditions:
+            - start_year <= end_year
+            - indicator1 != '' and indicator2 != ''
+            - indicator1 != indicator2
+            - region is None or region in self_regional_group['region'] or \
+            region in self_regional_group['sub-region']
+        """
+        year_mask = (self._store.years >= start_year) & (self._store.years <= end_year)
+        return self._query_arrays(year_mask, indicator1, indicator2, region)
+
+    def get_weighted_data_arrays(self, start_year: int, end_year: int, indicator1: str,
+                                 indicator2: str, weight_indicator: str,
+                                 region: Optional[str] = None) \
+            -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Returns the x- and y-coordinates of the data points from start_year to end_year
+        (inclusive) with the given indicators, like get_data_arrays, and the values of
+        weight_indicator for the same countries and years, as three arrays of the same
+        length. Only the points with a positive weight are returned.
+
+        Returns three empty arrays if there's no data.
+
+        Preconditions:
+            - start_year <= end_year
+            - indicator1 != '' and indicator2 != '' and weight_indicator != ''
+            - indicator1 != indicator2
+            - region is None or region in self_regional_group['region'] or \
+            region in self_regional_group['sub-region']
+        """
+        indicators = (indicator1, indicator2, weight_indicator)
+        if not all(self._store.has_indicator(indicator) for indicator in indicators):
+            return (numpy.empty(0), numpy.empty(0), numpy.empty(0))
+
+        year_mask = (self._store.years >= start_year) & (self._store.years <= end_year)
+        rows = slice(None) if region is None else self._region_mask(region)
+        x, y, w = (self._store.values(indicator)[rows][:, year_mask]
+                   for indicator in indicators)
+        # NaN weights are not positive, so the mask also drops the missing ones.
+        mask = ~(numpy.isnan(x) | numpy.isnan(y)) & (w > 0)
+        return (x[mask], y[mask], w[mask])
+
+    def _query_arrays(self, cols: numpy.ndarray, indicator1: str, indicator2: str,
+                      region: Optional[str]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Returns the x- and y-coordinates of the data points in the given year columns
+        of _store (either column indices or a boolean mask) and in the given region."""
+        if not self._store.has_indicator(indicator1) or not self._store.has_indicator(indicator2):
+            return (numpy.empty(0), numpy.empty(0))
+
+        rows = slice(None) if region is None else self._region_mask(region)
+        return paired_values(self._store.values(indicator1)[rows][:, cols],
+                             self._store.values(indicator2)[rows][:, cols])
+
+    def regression_table(self, pairs: Optional[List[Tuple[str, str]]] = None,
+                         windows: Optional[List[Tuple[int, int]]] = None,
+                         min_points: int = 3) -> List[Dict[str, Any]]:
+        """Returns the linear regressions of every combination of an indicator pair, a
+        region, and a year window, ranked from the highest to the lowest R squared value.
+
+        Each regression is a dictionary with the keys 'x', 'y' (the indicators), 'region'
+        (None for the whole world), 'start' and 'end' (the years of the window, inclusive),
+        'a' and 'b' (the line y = a + bx), 'r_squared', and 'n' (the number of data
+        points). Regressions with fewer than min_points points, or with all their x values
+        the same, are left out.
+
+            - pairs are the (x, y) indicator pairs to fit. By default, every ordered pair of
+            two different indicators.
+            - windows are the (start year, end year) windows. By default, all the years.
+
+        For every pair, the sums that the regressions need are computed for all regions
+        and windows at once, as products of the region masks, the data, and the window
+        masks, so the whole table takes a few matrix products per pair.
+
+        Preconditions:
+            - all(self._store.has_indicator(x) and self._store.has_indicator(y)
+                  for x, y in pairs)
+            - min_points >= 2
+        """
+        if pairs is None:
+            pairs = [(x, y) for x in sorted(self._indicators) for y in sorted(self._indicators)
+                     if x != y]
+        years = self._store.years
+        if windows is None:
+            windows = [(int(years[0]), int(years[-1]))] if len(years) > 0 else []
+
+        regions = [None] + self.get_regions() + self.get_subregions()
+        region_masks = numpy.array(
+            [numpy.ones(len(self._store), dtype=bool)] +
+            [self._region_masks['region'][region] for region in self.get_regions()] +
+            [self._region_masks['sub-region'][region] for region in self.get_subregions()],
+            dtype=numpy.float64)
+        window_masks = numpy.array([(years >= start) & (years <= end) for start, end in windows],
+                                   dtype=numpy.float64).reshape((len(windows), len(years)))
+
+        # Accumulator: The regressions fitted so far.
+        table_so_far = []
+        for x_indicator, y_indicator in pairs:
+            x = self._store.values(x_indicator)
+            y = self._store.values(y_indicator)
+            valid = ~(numpy.isnan(x) | numpy.isnan(y))
+            if not valid.any():
+                continue
+
+            x_shift = float(x[valid].mean())
+            y_shift = float(y[valid].mean())
+            dx = numpy.where(valid, x - x_shift, 0.0)
+            dy = numpy.where(valid, y - y_shift, 0.0)
+
+            # sums[i, r, k] is the sum of the i-th quantity over region r and window k.
+            quantities = numpy.stack([valid.astype(numpy.float64), dx, dy, dx * dx, dx * dy,
+                                      dy * dy])
+            sums = region_masks @ quantities @ window_masks.T
+            n = numpy.rint(sums[0]).astype(numpy.int64)
+            a, b, r2 = regression.line_fits_from_sums(n, *sums[1:], x_shift, y_shift)
+
+            for r, k in zip(*numpy.nonzero((n >= min_points) & ~numpy.isnan(r2))):
+                table_so_far.append({'x': x_indicator, 'y': y_indicator, 'region': regions[r],
+                                     'start': windows[k][0], 'end': windows[k][1],
+                                     'a': float(a[r, k]), 'b': float(b[r, k]),
+                                     'r_squared': float(r2[r, k]), 'n': int(n[r, k])})
+
+        table_so_far.sort(key=lambda row: row['r_squared'], reverse=True)
+        return table_so_far
+
+    def correlation_matrix(self, method: str = 'pearson', region: Optional[str] = None,
+                           start_year: Optional[int] = None, end_year: Optional[int] = None) \
+            -> Tuple[List[str], numpy.ndarray, numpy.ndarray]:
+        """Returns the sorted indicators, the matrix of the correlation coefficients of
+        every pair of them, and the matrix of the numbers of data points each coefficient
+        was computed from.
+
+        The data points of a pair are the (country, year) cells of the given region
+        (the whole world if None) and years (inclusive, all years if None) where both
+        indicators have a value. A coefficient is NaN when it cannot be computed.
+
+        The result is cached in CORRELATION_CACHE for every version of the data, and its
+        arrays are read-only.
+
+        Preconditions:
+            - method in CORRELATION_METHODS
+            - start_year is None or end_year is None or start_year <= end_year
+        """
+        key = (self.version, method, region, start_year, end_year)
+
+        def compute() -> Tuple[List[str], numpy.ndarray, numpy.ndarray]:
+            """Compute the matrices from the store."""
+            indicators = sorted(self._indicators)
+            years = self._store.years
+            cols = numpy.ones(len(years), dtype=bool)
+            if start_year is not None:
+                cols &= years >= start_year
+            if end_year is not None:
+                cols &= years <= end_year
+            rows = slice(None) if region is None else self._region_mask(region)
+
+            values = numpy.array([self._store.values(indicator)[rows][:, cols].ravel()
+                                  for indicator in indicators]).reshape((len(indicators), -1))
+            r, n = CORRELATION_METHODS[method](values)
+            r.flags.writeable = False
+            n.flags.writeable = False
+            return (indicators, r, n)
+
+        return CORRELATION_CACHE.get_or_compute(key, compute)
+
+    def _region_mask(self, region: str) -> numpy.ndarray:
+        """Returns the mask of the rows of _store in the given region or sub-region.
+
+        Preconditions:
+            - region in self.get_regions() or region in self.get_subregions()
+        """
+        if region in self._region_masks['region']:
+            return self._region_masks['region'][region]
+        return self._region_masks['sub-region'][region]
 
     def get_country_name_list(self) -> List[Tuple[str, str]]:
         """Returns the list of country name and country code in alphabetical order"""
@@ -172,40 +609,52 @@ class NoDataPointsException(Exception):
         return "No data points."
 
 
-# Helper function
-def update_gapminder_data(data: dict, years: List[int], country: Country,
-                          region_type: str, *indicators) -> None:
-    """Mutate the data dictionary by adding data obtained from the country in the given
-    years.
+class FrozenManagerException(Exception):
+    """Exception raises when attempting to load data into a frozen (shared) data manager."""
+    def __str__(self) -> str:
+        return "The data manager is read-only."
+
+
+# Helper functions
+def _timed_read(filepath: str) -> Tuple[Tuple[List[str], List[str], List[int], numpy.ndarray],
+                                         float]:
+    """Returns the table of the given data file (see snapshot.load_formatted_table) and the
+    number of seconds taken to read it. This runs in the worker processes of load_files."""
+    start = time.perf_counter()
+    table = snapshot.load_formatted_table(filepath)
+    return (table, time.perf_counter() - start)
+
+
+def update_gapminder_data(data: dict, years: List[int], region: str, names: List[str],
+                          values: Dict[str, numpy.ndarray]) -> None:
+    """Mutate the data dictionary by adding the data of the given countries of a region
+    in the given years. Countries missing a value of any indicator in any year are left out.
+
+        - names are the names of the countries.
+        - values maps each indicator to its (countries x years) array of values, with
+        the countries in the same order as names.
 
     Preconditions:
         - all(year in data for year in years)
         - all('population' in data[year] for year in years)
-        - 'population' in indicators
-        - region_type in {'region', 'sub-region'}
+        - 'population' in values
+        - all(array.shape == (len(names), len(years)) for array in values.values())
     """
-    # Accumulator
-    temp_data = {}
-    for indicator in indicators:
-        temp_data[indicator] = country.get_data_values(years, indicator)
+    keep = valid_rows(list(values.values()))
+    kept_names = [names[i] for i in range(len(names)) if keep[i]]
 
     min_pop = 8913
     max_pop = 1397715000
+    # Rescale population to the range 120-130 to later match with circle radius
+    population = (((values['population'][keep] - min_pop) * 120) / (max_pop - min_pop)) + 10
 
-    if any({temp_data[ind] == [] and ind not in {'region', 'name'}
-            for ind in indicators}):
-        return  # Immediately return, so the data will not be updated.
-    country_name = country.name
-    region = country.region[region_type]
     for i in range(len(years)):
-        # Rescale population to the range 120-130 to later match with circle radius
-        cur_pop = (((temp_data['population'][i] - min_pop) * 120) / (max_pop - min_pop)) + 10
-        list.append(data[years[i]]['population'], cur_pop)
-        list.append(data[years[i]]['region'], region)
-        list.append(data[years[i]]['name'], country_name)
-        for indicator in indicators:
-            if indicator not in {'population', 'region', 'name'}:
-                list.append(data[years[i]][indicator], temp_data[indicator][i])
+        data[years[i]]['population'] += population[:, i].tolist()
+        data[years[i]]['region'] += [region] * len(kept_names)
+        data[years[i]]['name'] += kept_names
+        for indicator in values:
+            if indicator != 'population':
+                data[years[i]][indicator] += values[indicator][keep, i].tolist()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+"""
+CSC110 Course Project: Air Pollution and Forestry
+=========================================================================================
+DataStore Class
+The data store owns the single, preloaded data manager that is shared by every session
+of the bokeh server, and swaps it for a freshly loaded one when the data files change.
+=========================================================================================
+@author: Tu Anh Pham
+"""
+import os
+import threading
+from typing import Callable, Dict, List, Tuple
+
+import metrics
+from data_manager import DataManager
+
+
+class DataStore:
+    """A process-wide holder of a read-only data manager.
+
+    The data manager is built once when the store is created. Sessions only read from
+    it, so they never touch the disk. When the watched data files change, a new manager
+    is built in the background and replaces the old one in a single assignment: sessions
+    that were opened before the swap keep using the old manager until they close.
+
+    Instance Attributes:
+        - version: The number of times the data manager has been (re)built.
+
+    Representation Invariants:
+        - self.version >= 1
+    """
+    # Private Instance Attributes:
+    #   - _builder: The function that loads and returns a new data manager.
+    #   - _filepaths: The data files that are watched for changes.
+    #   - _manager: The current data manager. It is frozen and must not be mutated.
+    #   - _stamps: The mapping of watched file paths to their (size, mtime) when
+    #   _manager was built.
+    #   - _lock: Serializes reloads so that two reloads never run at the same time.
+    _builder: Callable[[], DataManager]
+    _filepaths: List[str]
+    _manager: DataManager
+    _stamps: Dict[str, Tuple[int, int]]
+    _lock: threading.Lock
+
+    version: int
+
+    def __init__(self, builder: Callable[[], DataManager], filepaths: List[str]) -> None:
+        """Initialize the store and build its first data manager.
+
+        Preconditions:
+            - filepaths contains every file that builder reads.
+        """
+        self._builder = builder
+        self._filepaths = list(filepaths)
+        self._lock = threading.Lock()
+        self.version = 0
+        self._stamps = self._file_stamps()
+        self._manager = self._build()
+
+    def get_manager(self) -> DataManager:
+        """Returns the current data manager. The returned manager must not be mutated."""
+        return self._manager
+
+    def reload_if_changed(self) -> bool:
+        """Rebuild the data manager if any watched file changed since the last build,
+        then swap it in atomically.
+
+        Returns whether a new data manager was swapped in.
+        """
+        with self._lock:
+            stamps = self._file_stamps()
+            if stamps == self._stamps:
+                return False
+
+            with metrics.timed('data_reload'):
+                new_manager = self._build()
+            self._stamps = stamps
+            self._manager = new_manager     # The swap is a single reference assignment.
+            metrics.DATA_RELOADS.inc()
+            return True
+
+    def _build(self) -> DataManager:
+        """Build, freeze, and return a new data manager."""
+        manager = self._builder()
+        manager.freeze()
+        self.version += 1
+        return manager
+
+    def _file_stamps(self) -> Dict[str, Tuple[int, int]]:
+        """Returns the mapping of watched file paths to their current (size, mtime).
+        Missing files are mapped to (-1, -1)."""
+        # Accumulator: The mapping of file paths to their stamps.
+        stamps_so_far = {}
+        for filepath in self._filepaths:
+            try:
+                stat = os.stat(filepath)
+                stamps_so_far[filepath] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                stamps_so_far[filepath] = (-1, -1)
+
+        return stamps_so_far
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={'max-line-length': 100})
@@ -0,0 +1,109 @@
+"""
+CSC110 Course Project: Air Pollution and Forestry
+=========================================================================================
+downsample.py
+Provides the level of detail of large scatter plots: instead of every point, the
+browser receives a representative sample of the points, with about one point per few
+pixels of the plot, so the data sent and drawn stays bounded however many points there
+are.
+=========================================================================================
+@author: Tu Anh Pham
+"""
+from typing import Optional, Tuple
+
+import numpy
+
+# The number of points above which a scatter plot shows a sample of the points.
+LOD_THRESHOLD = 20000
+
+# The width and height (in pixels) of the cells of the grid a sample is drawn from.
+CELL_PIXELS = 5
+
+# How much of the width and height of the visible part of a plot is also sampled on every
+# side of it, so that a small pan does not show an empty border.
+VIEW_MARGIN = 0.25
+
+
+def level_of_detail(x: numpy.ndarray, y: numpy.ndarray, width: int, height: int,
+                    bounds: Optional[Tuple[float, float, float, float]] = None) \
+        -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Returns the x- and y-coordinates of the points to draw on a plot of width x height
+    pixels showing the points (x[i], y[i]).
+
+    bounds is the (x_start, x_end, y_start, y_end) visible part of the plot, or None if
+    the plot shows all points. Only the points in the visible part, with a margin of
+    VIEW_MARGIN around it, are returned. If there are more than LOD_THRESHOLD of them,
+    only one point of every cell of CELL_PIXELS x CELL_PIXELS pixels is returned.
+
+    Preconditions:
+        - len(x) == len(y)
+        - width > 0 and height > 0
+
+    >>> x = numpy.arange(100000.0)
+    >>> len(level_of_detail(x, x, 800, 800)[0]) <= (800 // CELL_PIXELS) ** 2
+    True
+    >>> len(level_of_detail(x, x, 800, 800, (0.0, 99.0, 0.0, 99.0))[0])
+    124
+    """
+    if bounds is not None:
+        x_start, x_end, y_start, y_end = _with_margin(bounds)
+        visible = (x >= x_start) & (x <= x_end) & (y >= y_start) & (y <= y_end)
+        x = x[visible]
+        y = y[visible]
+        width = int(width * (1 + 2 * VIEW_MARGIN))
+        height = int(height * (1 + 2 * VIEW_MARGIN))
+
+    if len(x) <= LOD_THRESHOLD:
+        return (x, y)
+
+    sample = grid_sample(x, y, max(1, width // CELL_PIXELS), max(1, height // CELL_PIXELS))
+    return (x[sample], y[sample])
+
+
+def grid_sample(x: numpy.ndarray, y: numpy.ndarray, columns: int, rows: int) -> numpy.ndarray:
+    """Returns the sorted indices of a sample of the points (x[i], y[i]): the first point
+    of every occupied cell of a grid of columns x rows cells spanning the points.
+
+    Preconditions:
+        - len(x) == len(y) > 0
+        - columns > 0 and rows > 0
+
+    >>> grid_sample(numpy.array([0.0, 0.1, 1.0]), numpy.array([0.0, 0.1, 1.0]), 2, 2).tolist()
+    [0, 2]
+    """
+    column = _cell_of(x, columns)
+    row = _cell_of(y, rows)
+    _, first = numpy.unique(row * columns + column, return_index=True)
+    return numpy.sort(first)
+
+
+# Helper functions
+def _cell_of(values: numpy.ndarray, num_cells: int) -> numpy.ndarray:
+    """Returns the index of the cell of every value, when the range of the values is cut
+    into num_cells equal cells."""
+    low = values.min()
+    span = values.max() - low
+    if not span > 0:
+        return numpy.zeros(len(values), dtype=numpy.int64)
+
+    cells = ((values - low) * (num_cells / span)).astype(numpy.int64)
+    return numpy.minimum(cells, num_cells - 1)
+
+
+def _with_margin(bounds: Tuple[float, float, float, float]) -> Tuple[float, float, float, float]:
+    """Returns the given (x_start, x_end, y_start, y_end) bounds grown by VIEW_MARGIN on
+    every side. The starts may be greater than the ends, as in a flipped axis."""
+    x_start, x_end, y_start, y_end = bounds
+    x_low, x_high = min(x_start, x_end), max(x_start, x_end)
+    y_low, y_high = min(y_start, y_end), max(y_start, y_end)
+    x_margin = (x_high - x_low) * VIEW_MARGIN
+    y_margin = (y_high - y_low) * VIEW_MARGIN
+    return (x_low - x_margin, x_high + x_margin, y_low - y_margin, y_high + y_margin)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(config={'max-line-length': 100, 'extra-imports': ['numpy']})
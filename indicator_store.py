@@ -0,0 +1,259 @@
+"""
+CSC110 Course Project: Air Pollution and Forestry
+=========================================================================================
+IndicatorStore Class
+The indicator store keeps the data values of every country in dense NumPy arrays, one
+array per indicator, so that queries over many countries and years are array slices.
+=========================================================================================
+@author: Tu Anh Pham
+"""
+from __future__ import annotations
+import json
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy
+
+# The name of the index file written by IndicatorStore.save.
+STORE_INDEX_FILE = 'store.json'
+
+
+class IndicatorStore:
+    """A columnar store of indicator data.
+
+    Every indicator is a float64 array of shape (number of rows, number of years). A row
+    corresponds to a country code and a column to a year. Missing values are NaN, so
+    numpy.isnan(store.values(indicator)) is the mask of missing data.
+
+    Instance Attributes:
+        - codes: The country codes, in row order.
+        - years: The sorted years, in column order.
+
+    Representation Invariants:
+        - all(self.years[i] < self.years[i + 1] for i in range(len(self.years) - 1))
+        - len(self.codes) == len(set(self.codes))
+    """
+    # Private Instance Attributes:
+    #   - _code_index: The mapping of country codes to their row indices.
+    #   - _year_index: The mapping of years to their column indices.
+    #   - _values: The mapping of indicator names to their data arrays. The arrays have
+    #   more rows than len(self.codes) so that adding a row is amortized O(1). Only the
+    #   first len(self.codes) rows are meaningful.
+    #   - _capacity: The number of rows allocated in every array of _values.
+    #   - _frozen: Whether the arrays are read-only.
+    _code_index: Dict[str, int]
+    _year_index: Dict[int, int]
+    _values: Dict[str, numpy.ndarray]
+    _capacity: int
+    _frozen: bool
+
+    codes: List[str]
+    years: numpy.ndarray
+
+    def __init__(self, years: Optional[List[int]] = None) -> None:
+        """Initialize an empty store with the given years as columns.
+        More years are added when data of other years is written.
+        """
+        self.codes = []
+        self._code_index = {}
+        self._values = {}
+        self._capacity = 0
+        self._frozen = False
+        self.years = numpy.array(sorted(set(years or [])), dtype=numpy.int64)
+        self._year_index = {int(year): i for i, year in enumerate(self.years)}
+
+    def __len__(self) -> int:
+        """Returns the number of rows (country codes) in the store."""
+        return len(self.codes)
+
+    def add_row(self, code: str) -> int:
+        """Add a row for the given country code and return its index.
+        Returns the existing index if the code already has a row.
+        """
+        if code in self._code_index:
+            return self._code_index[code]
+
+        if len(self.codes) == self._capacity:
+            self._resize(max(16, self._capacity * 2), self.years)
+
+        self._code_index[code] = len(self.codes)
+        self.codes.append(code)
+        return self._code_index[code]
+
+    def row_of(self, code: str) -> int:
+        """Returns the row index of the given country code.
+
+        Preconditions:
+            - code in self.codes
+        """
+        return self._code_index[code]
+
+    def rows_of(self, codes: Set[str]) -> numpy.ndarray:
+        """Returns the sorted row indices of the given country codes.
+        Codes without a row are ignored."""
+        return numpy.array(sorted(self._code_index[code] for code in codes
+                                  if code in self._code_index), dtype=numpy.int64)
+
+    def year_columns(self, years: List[int]) -> numpy.ndarray:
+        """Returns the column indices of the given years, in the same order.
+        Years without a column are left out."""
+        return numpy.array([self._year_index[year] for year in years
+                            if year in self._year_index], dtype=numpy.int64)
+
+    def has_years(self, years: List[int]) -> bool:
+        """Returns whether every given year has a column."""
+        return all(year in self._year_index for year in years)
+
+    def indicators(self) -> Set[str]:
+        """Returns the set of indicators in the store."""
+        return set(self._values.keys())
+
+    def has_indicator(self, indicator: str) -> bool:
+        """Returns whether the store has data of the given indicator."""
+        return indicator in self._values
+
+    def values(self, indicator: str) -> numpy.ndarray:
+        """Returns the (rows x years) array of the given indicator. The array is a view,
+        so it must not be mutated.
+
+        Preconditions:
+            - self.has_indicator(indicator)
+        """
+        return self._values[indicator][:len(self.codes)]
+
+    def set_values(self, indicator: str, row: int, data: Dict[int, float]) -> None:
+        """Write the {year: value} mapping into the given row of the given indicator.
+        Values of the years not in data are kept.
+
+        Preconditions:
+            - 0 <= row < len(self)
+        """
+        self._ensure(indicator, list(data.keys()))
+        array = self._values[indicator]
+        for year in data:
+            array[row, self._year_index[year]] = data[year]
+
+    def set_block(self, indicator: str, rows: numpy.ndarray, years: List[int],
+                  block: numpy.ndarray) -> None:
+        """Write a block of values into the given rows and years of the given indicator.
+        block[i, j] is the value of row rows[i] in year years[j]. NaN values in block do not
+        overwrite the values already in the store.
+
+        Preconditions:
+            - block.shape == (len(rows), len(years))
+            - all(0 <= row < len(self) for row in rows)
+        """
+        self._ensure(indicator, years)
+        array = self._values[indicator]
+        cols = self.year_columns(years)
+
+        if len(numpy.unique(rows)) != len(rows):
+            # Repeated rows must be merged one after another.
+            for i in range(len(rows)):
+                self.set_block(indicator, rows[i:i + 1], years, block[i:i + 1])
+            return
+
+        current = array[numpy.ix_(rows, cols)]
+        array[numpy.ix_(rows, cols)] = numpy.where(numpy.isnan(block), current, block)
+
+    def freeze(self) -> None:
+        """Make every data array read-only."""
+        self._frozen = True
+        for array in self._values.values():
+            array.flags.writeable = False
+
+    def save(self, folder: str) -> None:
+        """Save the store into the given folder: one .npy file per indicator and an index
+        file of the codes, years, and indicator names. The folder is created if needed.
+        """
+        os.makedirs(folder, exist_ok=True)
+        # Accumulator: The mapping of indicator names to their file names.
+        files_so_far = {}
+        for i, indicator in enumerate(sorted(self._values)):
+            files_so_far[indicator] = str(i) + '.npy'
+            numpy.save(os.path.join(folder, files_so_far[indicator]), self.values(indicator))
+
+        with open(os.path.join(folder, STORE_INDEX_FILE), 'w') as file:
+            json.dump({'codes': self.codes, 'years': self.years.tolist(),
+                       'indicators': files_so_far}, file)
+
+    @staticmethod
+    def open(folder: str) -> IndicatorStore:
+        """Returns a frozen store whose arrays are memory-mapped, read-only, from the files
+        saved in the given folder by IndicatorStore.save.
+
+        The arrays are not copied into memory, so every process that opens the same folder
+        shares a single copy of the data through the page cache.
+        """
+        with open(os.path.join(folder, STORE_INDEX_FILE)) as file:
+            index = json.load(file)
+
+        store = IndicatorStore(index['years'])
+        store.codes = index['codes']
+        store._code_index = {code: i for i, code in enumerate(store.codes)}
+        store._capacity = len(store.codes)
+        for indicator, filename in index['indicators'].items():
+            store._values[indicator] = numpy.load(os.path.join(folder, filename), mmap_mode='r')
+        store._frozen = True
+
+        return store
+
+    def nbytes(self) -> int:
+        """Returns the number of bytes used by the data arrays."""
+        return sum(array.nbytes for array in self._values.values())
+
+    def _ensure(self, indicator: str, years: List[int]) -> None:
+        """Make sure that the given indicator has an array and that all given years have
+        columns."""
+        new_years = [year for year in years if year not in self._year_index]
+        if new_years:
+            all_years = numpy.array(sorted(set(self.years.tolist()) | set(new_years)),
+                                    dtype=numpy.int64)
+            self._resize(self._capacity, all_years)
+
+        if indicator not in self._values:
+            self._values[indicator] = numpy.full((self._capacity, len(self.years)), numpy.nan)
+
+    def _resize(self, capacity: int, years: numpy.ndarray) -> None:
+        """Reallocate every array with the given number of rows and year columns, keeping
+        the existing values."""
+        old_cols = numpy.searchsorted(years, self.years)
+        for indicator, array in self._values.items():
+            new_array = numpy.full((capacity, len(years)), numpy.nan)
+            new_array[:array.shape[0], old_cols] = array
+            self._values[indicator] = new_array
+
+        self._capacity = capacity
+        self.years = years
+        self._year_index = {int(year): i for i, year in enumerate(years)}
+
+
+def valid_rows(arrays: List[numpy.ndarray]) -> numpy.ndarray:
+    """Returns the boolean mask of the rows that have no missing value in any of the
+    given (rows x years) arrays.
+
+    Preconditions:
+        - arrays != []
+        - all(array.shape == arrays[0].shape for array in arrays)
+    """
+    mask = numpy.ones(arrays[0].shape[0], dtype=bool)
+    for array in arrays:
+        mask &= ~numpy.isnan(array).any(axis=1)
+
+    return mask
+
+
+def paired_values(x: numpy.ndarray, y: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Returns the flattened values of x and y in the cells where both are present.
+
+    Preconditions:
+        - x.shape == y.shape
+    """
+    mask = ~(numpy.isnan(x) | numpy.isnan(y))
+    return x[mask], y[mask]
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={'max-line-length': 100, 'extra-imports': ['numpy']})
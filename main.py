@@ -5,15 +5,75 @@ main.py
 =========================================================
 @author: Tu Anh Pham
 """
+import argparse
+from functools import partial
+
 from bokeh.server.server import Server
-from presentation import bk_app
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+import bootstrap
+import metrics
+import session_worker
+from data_store import DataStore
+from presentation import (ANIMATION_MODES, bk_app, build_data_manager,
+                          build_mapped_data_manager, data_filepaths, set_explorer_cache_limit)
+
+# How often (in milliseconds) the data files are checked for changes.
+RELOAD_INTERVAL = 30000
+
+# The route serving the metrics of the server in the Prometheus text format.
+METRICS_ROUTE = '/metrics'
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the air pollution presentation server.')
+    parser.add_argument('--num-procs', type=int, default=1,
+                        help='the number of server processes. With more than one process, '
+                             'the data is memory-mapped and shared by all of them.')
+    parser.add_argument('--explorer-cache-mb', type=float, default=64,
+                        help='the memory ceiling, in megabytes, of the cache of data explorer '
+                             'results shared by all sessions of a process.')
+    parser.add_argument('--animation', choices=ANIMATION_MODES, default='client',
+                        help='where the gapminder animation runs: in the browser (client), or '
+                             'driven by the server (server).')
+    parser.add_argument('--workers', type=int, default=session_worker.DEFAULT_WORKERS,
+                        help='the number of threads of each process computing the data '
+                             'explorer queries of all sessions.')
+    parser.add_argument('--bootstrap-processes', type=int, default=None,
+                        help='the number of processes of each server process bootstrapping '
+                             'the confidence bands of the data explorer. Defaults to the '
+                             'number of CPUs shared among the server processes.')
+    parser.add_argument('--no-metrics', action='store_true',
+                        help='do not collect metrics nor serve them at ' + METRICS_ROUTE + '.')
+    args = parser.parse_args()
+    metrics.set_enabled(not args.no_metrics)
+    set_explorer_cache_limit(int(args.explorer_cache_mb * 1024 * 1024))
+    session_worker.set_worker_count(args.workers)
+    bootstrap.set_process_count(args.bootstrap_processes or
+                                max(1, bootstrap.DEFAULT_PROCESSES // args.num_procs))
+
+    # Load every data file once. All sessions share this store and never read the disk.
+    # The store is created before the server forks its worker processes, and with several
+    # processes its data arrays are memory-mapped, so the workers share one copy of them.
+    if args.num_procs == 1:
+        store = DataStore(build_data_manager, data_filepaths())
+    else:
+        store = DataStore(build_mapped_data_manager, data_filepaths())
+
     # Set the bokeh application for the bokeh server to run.
     # This enable interactive plotting.
-    server = Server({'/': bk_app}, num_procs=1)
+    extra_patterns = [] if args.no_metrics else [(METRICS_ROUTE, metrics.MetricsHandler)]
+    server = Server({'/': partial(bk_app, store=store, animation_mode=args.animation)},
+                    num_procs=args.num_procs, extra_patterns=extra_patterns)
     server.start()
 
-    server.io_loop.add_callback(server.show, "/")
+    # Reload the data in a worker thread when the files change, so that the server
+    # keeps answering requests while the new data manager is being built.
+    reload_callback = PeriodicCallback(
+        lambda: IOLoop.current().run_in_executor(None, store.reload_if_changed),
+        RELOAD_INTERVAL)
+    reload_callback.start()
+
+    if args.num_procs == 1:
+        server.io_loop.add_callback(server.show, "/")
     server.io_loop.start()
@@ -0,0 +1,359 @@
+"""
+CSC110 Course Project: Air Pollution and Forestry
+=========================================================================================
+metrics.py
+Collects the latency of the hot paths of the server (session setup, data loading,
+explorer queries, gapminder updates), counters, and memory gauges, and serves them in
+the Prometheus text format.
+
+Metrics are kept per process: with several server processes, each one reports its own.
+=========================================================================================
+@author: Tu Anh Pham
+"""
+import bisect
+import os
+import resource
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from tornado.web import RequestHandler
+
+# The upper bounds (in seconds) of the buckets of the latency histograms.
+DEFAULT_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0]
+
+# The content type of the Prometheus text format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Whether metrics are collected. See set_enabled.
+_enabled = True
+
+
+class Counter:
+    """A number that only goes up, such as the number of sessions opened.
+
+    Instance Attributes:
+        - name: The name of the metric.
+        - description: What the metric counts.
+        - value: The current count.
+
+    Representation Invariants:
+        - self.value >= 0
+    """
+    # Private Instance Attributes:
+    #   - _lock: Guards value, since sessions may run in several threads.
+    _lock: threading.Lock
+
+    name: str
+    description: str
+    value: float
+
+    def __init__(self, name: str, description: str) -> None:
+        """Initialize a counter at 0."""
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        """Add the given amount to the counter, if metrics are enabled.
+
+        Preconditions:
+            - amount >= 0
+        """
+        if _enabled:
+            with self._lock:
+                self.value += amount
+
+    def render(self) -> List[str]:
+        """Returns the lines of the counter in the Prometheus text format."""
+        return _header(self.name, self.description, 'counter') + \
+            [self.name + ' ' + _format(self.value)]
+
+
+class Gauge:
+    """A number read from a function every time the metrics are collected, such as the
+    memory used by the process. The function may also count something elsewhere, like the
+    hits of a cache, in which case the kind of the gauge is 'counter'.
+
+    Instance Attributes:
+        - name: The name of the metric.
+        - description: What the metric measures.
+        - kind: The Prometheus type of the metric.
+        - function: Returns the current value.
+
+    Representation Invariants:
+        - self.kind in {'gauge', 'counter'}
+    """
+    name: str
+    description: str
+    kind: str
+    function: Callable[[], float]
+
+    def __init__(self, name: str, description: str, function: Callable[[], float],
+                 kind: str = 'gauge') -> None:
+        """Initialize a gauge reading its value from the given function."""
+        self.name = name
+        self.description = description
+        self.function = function
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        """Returns the lines of the gauge in the Prometheus text format."""
+        return _header(self.name, self.description, self.kind) + \
+            [self.name + ' ' + _format(self.function())]
+
+
+class Histogram:
+    """The distribution of observed values, such as latencies, counted in buckets.
+    The values are observed separately for every value of one label, such as the stage
+    of the server that was timed.
+
+    Instance Attributes:
+        - name: The name of the metric.
+        - description: What the metric measures.
+        - label: The name of the label that the values are observed for.
+        - buckets: The sorted upper bounds of the buckets.
+
+    Representation Invariants:
+        - all(self.buckets[i] < self.buckets[i + 1] for i in range(len(self.buckets) - 1))
+    """
+    # Private Instance Attributes:
+    #   - _series: The mapping of label values to their bucket counts, the count of values
+    #   above the last bucket being last, and the sum of their observed values.
+    #   - _lock: Guards _series, since sessions may run in several threads.
+    _series: Dict[str, Tuple[List[int], List[float]]]
+    _lock: threading.Lock
+
+    name: str
+    description: str
+    label: str
+    buckets: List[float]
+
+    def __init__(self, name: str, description: str, label: str,
+                 buckets: Optional[List[float]] = None) -> None:
+        """Initialize a histogram without any observation."""
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = sorted(buckets or DEFAULT_BUCKETS)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        """Count the given value for the given label value, if metrics are enabled."""
+        if not _enabled:
+            return
+
+        with self._lock:
+            if label_value not in self._series:
+                self._series[label_value] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self._series[label_value]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def count(self, label_value: str) -> int:
+        """Returns the number of values observed for the given label value."""
+        with self._lock:
+            if label_value not in self._series:
+                return 0
+            return sum(self._series[label_value][0])
+
+    def render(self) -> List[str]:
+        """Returns the lines of the histogram in the Prometheus text format."""
+        # Accumulator: The lines of every series.
+        lines_so_far = _header(self.name, self.description, 'histogram')
+        with self._lock:
+            series = {value: (list(counts), total[0])
+                      for value, (counts, total) in self._series.items()}
+
+        for label_value in sorted(series):
+            counts, total = series[label_value]
+            label = self.label + '="' + _escape(label_value) + '"'
+            cumulative = 0
+            for i in range(len(self.buckets)):
+                cumulative += counts[i]
+                lines_so_far.append(self.name + '_bucket{' + label + ',le="' +
+                                    _format(self.buckets[i]) + '"} ' + str(cumulative))
+            cumulative += counts[-1]
+            lines_so_far.append(self.name + '_bucket{' + label + ',le="+Inf"} ' + str(cumulative))
+            lines_so_far.append(self.name + '_sum{' + label + '} ' + _format(total))
+            lines_so_far.append(self.name + '_count{' + label + '} ' + str(cumulative))
+
+        return lines_so_far
+
+
+class Timer:
+    """A context manager that observes the time spent in its block in a histogram.
+
+    >>> with Timer(STAGE_SECONDS, 'example'):
+    ...     pass
+    >>> STAGE_SECONDS.count('example') >= 1
+    True
+    """
+    # Private Instance Attributes:
+    #   - _histogram: The histogram the time is observed in.
+    #   - _stage: The label value the time is observed for.
+    #   - _start: The value of time.perf_counter() when the block was entered.
+    _histogram: Histogram
+    _stage: str
+    _start: float
+
+    def __init__(self, histogram: Histogram, stage: str) -> None:
+        """Initialize a timer for the given stage."""
+        self._histogram = histogram
+        self._stage = stage
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(self._stage, time.perf_counter() - self._start)
+
+
+class MetricsRegistry:
+    """The metrics collected by a process."""
+    # Private Instance Attributes:
+    #   - _metrics: The metrics, in the order they were registered.
+    _metrics: list
+
+    def __init__(self) -> None:
+        """Initialize an empty registry."""
+        self._metrics = []
+
+    def counter(self, name: str, description: str) -> Counter:
+        """Register and return a new counter."""
+        return self._register(Counter(name, description))
+
+    def gauge(self, name: str, description: str, function: Callable[[], float],
+              kind: str = 'gauge') -> Gauge:
+        """Register and return a new gauge reading its value from the given function."""
+        return self._register(Gauge(name, description, function, kind))
+
+    def histogram(self, name: str, description: str, label: str,
+                  buckets: Optional[List[float]] = None) -> Histogram:
+        """Register and return a new histogram."""
+        return self._register(Histogram(name, description, label, buckets))
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text format."""
+        # Accumulator: The lines of every metric.
+        lines_so_far = []
+        for metric in self._metrics:
+            lines_so_far.extend(metric.render())
+
+        return '\n'.join(lines_so_far) + '\n'
+
+    def _register(self, metric):
+        """Add the metric to the registry and return it."""
+        self._metrics.append(metric)
+        return metric
+
+
+class MetricsHandler(RequestHandler):
+    """The tornado handler serving the metrics of REGISTRY, for the route added to the
+    bokeh server in main.py."""
+
+    def get(self) -> None:
+        """Respond with every metric in the Prometheus text format."""
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.write(REGISTRY.render())
+
+
+def set_enabled(enabled: bool) -> None:
+    """Turn the collection of metrics on or off. While it is off, counters and histograms
+    are not updated, so the timing hooks cost almost nothing."""
+    global _enabled
+    _enabled = enabled
+
+
+def timed(stage: str) -> Timer:
+    """Returns a context manager observing the time spent in its block in STAGE_SECONDS,
+    for the given stage."""
+    return Timer(STAGE_SECONDS, stage)
+
+
+def register_cache(name: str, cache) -> None:
+    """Register gauges of the hits, misses, number of entries, and size of the given
+    cache.LRUCache, whose metric names start with airpollution_<name>_cache."""
+    prefix = 'airpollution_' + name + '_cache'
+    REGISTRY.gauge(prefix + '_hits_total', 'Lookups that found their key in the ' + name +
+                   ' cache.', lambda: cache.hits, 'counter')
+    REGISTRY.gauge(prefix + '_misses_total', 'Lookups that did not find their key in the ' +
+                   name + ' cache.', lambda: cache.misses, 'counter')
+    REGISTRY.gauge(prefix + '_entries', 'Entries in the ' + name + ' cache.', lambda: len(cache))
+    REGISTRY.gauge(prefix + '_bytes', 'Size of the values in the ' + name + ' cache.',
+                   lambda: cache.nbytes)
+
+
+def resident_memory() -> float:
+    """Returns the number of bytes of memory currently used by this process, or its peak
+    usage if the current one is not available."""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_memory()
+
+
+def peak_memory() -> float:
+    """Returns the peak number of bytes of memory used by this process."""
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Helper functions
+def _header(name: str, description: str, kind: str) -> List[str]:
+    """Returns the HELP and TYPE lines of a metric."""
+    return ['# HELP ' + name + ' ' + description.replace('\\', '\\\\').replace('\n', '\\n'),
+            '# TYPE ' + name + ' ' + kind]
+
+
+def _format(value: float) -> str:
+    """Returns the given value as written in the Prometheus text format.
+
+    >>> _format(3.0)
+    '3'
+    >>> _format(0.25)
+    '0.25'
+    """
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(label_value: str) -> str:
+    """Returns the given label value escaped for the Prometheus text format."""
+    return label_value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# The metrics of this process.
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram('airpollution_stage_seconds',
+                                   'Time spent in each stage of the server.', 'stage')
+FILE_READ_SECONDS = REGISTRY.histogram('airpollution_file_read_seconds',
+                                       'Time spent reading each data file.', 'file')
+SESSIONS = REGISTRY.counter('airpollution_sessions_total', 'Sessions opened.')
+EXPLORER_QUERIES = REGISTRY.counter('airpollution_explorer_queries_total',
+                                    'Data explorer queries.')
+GAPMINDER_UPDATES = REGISTRY.counter('airpollution_gapminder_updates_total',
+                                     'Gapminder years sent by the server.')
+STALE_REQUESTS = REGISTRY.counter('airpollution_stale_requests_total',
+                                  'Session requests dropped because a newer one was made.')
+DATA_RELOADS = REGISTRY.counter('airpollution_data_reloads_total',
+                                'Data managers swapped in after the data files changed.')
+REGISTRY.gauge('airpollution_resident_memory_bytes', 'Memory currently used by the process.',
+               resident_memory)
+REGISTRY.gauge('airpollution_peak_memory_bytes', 'Peak memory used by the process.',
+               peak_memory)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(verbose=True)
+
+    import python_ta
+    python_ta.check_all(config={'max-line-length': 100, 'extra-imports': ['tornado.web']})
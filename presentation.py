@@ -7,82 +7,243 @@ be called by the bokeh Server.
 =============================================================================
 @athor: Tu Anh Pham
 """
+from __future__ import annotations
+import hashlib
+import json
+import os
+import shutil
 
 import numpy
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from bokeh.plotting import figure, Figure
 from bokeh.io import doc
 from bokeh.models import (Button, CategoricalColorMapper, ColumnDataSource, Title,
                           HoverTool, Label, Slider, Dropdown, Paragraph, Column,
-                          RangeSlider)
+                          RangeSlider, CustomJS, LinearColorMapper, ColorBar)
 
 from bokeh.layouts import row, column
-from bokeh.palettes import Category20, Category10
+from bokeh.events import RangesUpdate
+from bokeh.palettes import Category20, Category10, RdBu11
+import bootstrap
+import data_extract
+import metrics
+from cache import LRUCache
 from data_manager import DataManager
+from data_store import DataStore
+from downsample import LOD_THRESHOLD, level_of_detail
+from session_worker import SessionWorker
 from regression import*
 
 
+# The file listing the data files to load and their indicator names.
+MANIFEST_FILE = 'data_manifest.json'
+
+# The ways the gapminder animation can be run (see setup_gapminder).
+ANIMATION_MODES = ('client', 'server')
+# The time (in milliseconds) between two years of the gapminder animation.
+ANIMATION_INTERVAL = 800
+
+# The width and height (in pixels) of the data explorer plot.
+EXPLORER_PLOT_SIZE = 800
+
+# The regression functions of the data explorer whose curve of best fit is a line, and
+# the indicator weighting the points of 'Population-weighted linear'.
+LINE_REGRESSIONS = ('Linear regression', 'Population-weighted linear', 'Theil-Sen (robust)',
+                    'Huber (robust)')
+WEIGHT_INDICATOR = 'population'
+
+# The regression functions of the data explorer shown with a bootstrapped confidence band,
+# and the kind of curve they fit (see bootstrap.py).
+BAND_REGRESSIONS = {'Linear regression': 'linear', 'Population-weighted linear': 'linear',
+                    'Least-square exponential': 'exponential'}
+# The number of x-coordinates at which the band of a line is evaluated.
+BAND_POINTS = 64
+# The number of resamples of a band, which is lowered for large data so that at most
+# BAND_MAX_DRAWS points are drawn. Since a band of fewer than BAND_MIN_RESAMPLES
+# resamples is too noisy, there is no band above BAND_MAX_POINTS points.
+BAND_RESAMPLES = 2000
+BAND_MIN_RESAMPLES = 200
+BAND_MAX_DRAWS = 2 * 10 ** 7
+BAND_MAX_POINTS = BAND_MAX_DRAWS // BAND_MIN_RESAMPLES
+
+# The folder of the memory-mapped datasets used when the server runs several processes.
+DATASET_FOLDER = 'Data/.dataset'
+
+# The results of data explorer queries and their confidence bands, shared by every session
+# (see get_explorer_result and get_explorer_band).
+EXPLORER_CACHE = LRUCache(256, max_bytes=64 * 1024 * 1024,
+                         sizeof=lambda result: result.nbytes())
+metrics.register_cache('explorer', EXPLORER_CACHE)
+
+# The data store shared by every session when bk_app is not given one.
+_shared_store = None
+
+
+def read_manifest(filepath: str = MANIFEST_FILE) -> List[Tuple[str, str]]:
+    """Returns the list of (file path, indicator name) pairs listed in the manifest file.
+
+    The manifest is a json list of objects with the keys 'indicator' and 'file'. It must
+    list the 'air pollution' indicator.
+    """
+    with open(filepath) as file:
+        entries = json.load(file)
+
+    return [(entry['file'], entry['indicator']) for entry in entries]
+
+
 def load_data(manager: DataManager) -> None:
-    """Returns a tuple of data necessary to create the gapmider plot."""
-    manager.load_data('Data/gdp_per_capita_formatted.csv', 'gdp per capita')
-    manager.load_data('Data/population_formatted.csv', 'population')
-    manager.load_data('Data/hdi_formatted.csv', 'hdi')
-    manager.load_data('Data/forest_area_formatted.csv', 'forest area (% of land area)')
-    manager.load_data('Data/motor_vehicle_formatted.csv', 'motor vehicle per capita')
-    manager.load_data('Data/manufacturing_formatted.csv', 'manufacturing (% of gdp)')
-    manager.load_data('Data/industry_formatted.csv', 'industry (% of gdp)')
-    manager.load_data('Data/coal_per_capita_formatted.csv', 'coal consumption per capita')
-    manager.load_data('Data/oil_per_capita_formatted.csv', 'oil consumption per capita')
-    manager.load_data('Data/gas_per_capita_formatted.csv', 'gas consumption per capita')
-    manager.load_data('Data/fossil_fuel_formatted.csv', 'fossil fuel consumption (total)')
-
-
-def bk_app(bk_document: doc) -> None:
+    """Load every data file in the manifest, other than the air pollution data, into the
+    manager. The files are read in parallel."""
+    manager.load_files([(filepath, indicator) for filepath, indicator in read_manifest()
+                        if indicator != 'air pollution'])
+
+
+def build_data_manager() -> DataManager:
+    """Returns a new data manager loaded with every data file in the manifest.
+    All files, including the air pollution data, are read in parallel."""
+    files = read_manifest()
+    air_filepath = [filepath for filepath, indicator in files if indicator == 'air pollution'][0]
+    return DataManager(air_filepath,
+                       indicator_files=[(filepath, indicator) for filepath, indicator in files
+                                        if indicator != 'air pollution'])
+
+
+def build_mapped_data_manager() -> DataManager:
+    """Returns a data manager whose data arrays are memory-mapped from a dataset folder in
+    DATASET_FOLDER, building the folder from the data files first if they changed.
+
+    Every process calling this function with the same data files maps the same folder,
+    so worker processes of the bokeh server share one copy of the data.
+    """
+    # The dataset folder is named after the sizes and modification times of the data files.
+    stamps = []
+    for filepath in data_filepaths():
+        stat = os.stat(filepath)
+        stamps.append(f'{filepath}:{stat.st_size}:{stat.st_mtime_ns}')
+    key = hashlib.sha256('\n'.join(stamps).encode()).hexdigest()[:16]
+    folder = os.path.join(DATASET_FOLDER, key)
+
+    if not os.path.isdir(folder):
+        os.makedirs(DATASET_FOLDER, exist_ok=True)
+        build_data_manager().save_dataset(folder)
+        # Remove the datasets of older versions of the data files. Processes that still
+        # map them keep their data until they unmap it.
+        for name in os.listdir(DATASET_FOLDER):
+            if name != key and '.' not in name:
+                shutil.rmtree(os.path.join(DATASET_FOLDER, name), ignore_errors=True)
+
+    return DataManager.open_dataset(folder)
+
+
+def data_filepaths() -> List[str]:
+    """Returns the paths of every data file read by build_data_manager."""
+    return [MANIFEST_FILE, data_extract.WORLD_GEO_FILE] + \
+        [filepath for filepath, _ in read_manifest()]
+
+
+def get_shared_store() -> DataStore:
+    """Returns the process-wide data store, building it on the first call."""
+    global _shared_store
+    if _shared_store is None:
+        _shared_store = DataStore(build_data_manager, data_filepaths())
+    return _shared_store
+
+
+def bk_app(bk_document: doc, store: Optional[DataStore] = None,
+           animation_mode: str = 'client') -> None:
     """This is a bokeh application.
 
     The function will be called every time a client establish a connection with the bokeh
     server. It initializes a layout and feeds callables to the bokeh document, which was created
     by the server and will be used by the server for the given session.
+
+    The data comes from the given store, which is shared by all sessions, so no data file is
+    read here. When store is None, the process-wide store from get_shared_store is used.
+    animation_mode is passed to setup_gapminder.
+
+    Preconditions:
+        - animation_mode in ANIMATION_MODES
     """
-    manager = DataManager('Data/air_pollution_formatted.csv')
-    load_data(manager)
+    metrics.SESSIONS.inc()
+    with metrics.timed('session_setup'):
+        if store is None:
+            store = get_shared_store()
+        manager = store.get_manager()
 
-    first_section = setup_gapminder(bk_document, manager)
-    second_section = setup_data_explorer(manager)
-    layout = column(first_section, second_section)
+        first_section = setup_gapminder(bk_document, manager, animation_mode)
+        second_section = setup_data_explorer(manager, bk_document)
+        third_section = setup_correlation_heatmap(manager, bk_document)
+        layout = column(first_section, second_section, third_section)
 
-    bk_document.add_root(layout)
-    bk_document.title = "Presentation"
+        bk_document.add_root(layout)
+        bk_document.title = "Presentation"
 
 
-def setup_gapminder(bk_document: doc, manager: DataManager) -> Column:
+def setup_gapminder(bk_document: doc, manager: DataManager,
+                    animation_mode: str = 'client') -> Column:
     """Setting up for the "gapminder" part of the presentation by
     mutating the given bokeh document.
 
+    With animation_mode == 'client', every year of data is sent to the browser once and the
+    ► Play animation runs in the browser, so a playing session costs the server nothing per
+    frame. With animation_mode == 'server', the server changes the year periodically and
+    sends the data of each year.
+
     Preconditions:
         - manager is already loaded with population, gdp, and air pollution data.
+        - animation_mode in ANIMATION_MODES
     """
     years = [1990, 1995, 2000, 2005] + [year for year in range(2010, 2018)]
     # Get data of the whole world. (When the default value of 'regions' is None)
-    data = manager.get_gapminder_data_from_regions(years, 'population', 'gdp per capita',
-                                                   'air pollution', region_type='region')
+    # The frames are computed once per version of the data and shared by all sessions.
+    data = manager.get_gapminder_frames(years, 'population', 'gdp per capita',
+                                        'air pollution', region_type='region')
     regions = list(set(data[years[0]]['region']))
 
-    source = ColumnDataSource(data=data[years[0]])
+    # The names and regions are the same in every year, so they are sent to the browser once.
+    # Changing the year only re-sends the numeric columns, as binary arrays.
+    numeric_columns = ['population', 'gdp per capita', 'air pollution']
+    source = ColumnDataSource(data=dict(data[years[0]]))
     plot = create_air_gpd_plot(source, regions)
 
     label = Label(x=50000, y=76, text=str(years[0]), text_font_size='73px', text_color='#A9A9A9')
     plot.add_layout(label)
 
-    # The id of the callback function that will be saved in bk_document.
-    callback_id = None
     # Creating ui components and their associating callables.
     play_button = Button(label='► Play')
+    slider = Slider(start=years[0], end=years[-1], value=years[0], step=1, title="Year")
+
+    if animation_mode == 'client':
+        setup_client_animation(data, years, numeric_columns, source, plot, label, slider,
+                               play_button)
+    else:
+        setup_server_animation(bk_document, data, years, numeric_columns, source, label,
+                               slider, play_button)
+
+    gapminder_ui = column(play_button, slider, margin=(10, 0, 0, 0))
+    gapminder = row(gapminder_ui, plot, margin=(40, 0, 0, 0))
+    gapminder_desc = Paragraph(text="""GDP per capita and the measured concentration of PM 2.5 
+    (micrograms of PM2.5 per cubic meter of different countries over the years. The size of the 
+    circles is population.""")
+    return column(gapminder_desc, gapminder, margin=(40, 0, 0, 40))
+
+
+def setup_server_animation(bk_document: doc, data: Dict[int, dict], years: List[int],
+                           numeric_columns: List[str], source: ColumnDataSource, label: Label,
+                           slider: Slider, play_button: Button) -> None:
+    """Make the slider and the play button of the gapminder plot change the year on the
+    server. While playing, a periodic callback of the session moves the slider.
+
+    Preconditions:
+        - all(year in data for year in years)
+    """
+    # The id of the periodic callback while the animation is playing, None otherwise.
+    callback_id = None
 
     def gapminder_update() -> None:
         """Function will be called periodically by the server when ► Play is clicked.
         Update the state of the gapminder plot."""
-        global callback_id
+        nonlocal callback_id
         if slider.value < 2010:
             year = slider.value + 5
         else:
@@ -92,40 +253,118 @@ def setup_gapminder(bk_document: doc, manager: DataManager) -> Column:
         if year == years[-1]:
             play_button.label = '► Play'
             bk_document.remove_periodic_callback(callback_id)
+            callback_id = None
         slider.value = year
 
     def slider_update(attrname, old, new) -> None:
         """Function called when the state of the slider is changed."""
-        year = slider.value
-        label.text = str(year)
-        source.data = data[year]
+        with metrics.timed('gapminder_update'):
+            year = slider.value
+            label.text = str(year)
+            if year in data:
+                metrics.GAPMINDER_UPDATES.inc()
+                source.data.update({column: data[year][column] for column in numeric_columns})
 
-    slider = Slider(start=years[0], end=years[-1], value=years[0], step=1, title="Year")
     slider.on_change('value', slider_update)
 
     def animate() -> None:
         """Function called when the play/pause button is clicked."""
-        global callback_id
-        if play_button.label == '► Play':
+        nonlocal callback_id
+        if callback_id is None:
             play_button.label = '❚❚ Pause'
-            callback_id = bk_document.add_periodic_callback(gapminder_update, 800)
+            callback_id = bk_document.add_periodic_callback(gapminder_update, ANIMATION_INTERVAL)
         else:
             play_button.label = '► Play'
             bk_document.remove_periodic_callback(callback_id)
+            callback_id = None
 
     play_button.on_click(animate)
-    gapminder_ui = column(play_button, slider, margin=(10, 0, 0, 0))
-    gapminder = row(gapminder_ui, plot, margin=(40, 0, 0, 0))
-    gapminder_desc = Paragraph(text="""GDP per capita and the measured concentration of PM 2.5 
-    (micrograms of PM2.5 per cubic meter of different countries over the years. The size of the 
-    circles is population.""")
-    return column(gapminder_desc, gapminder, margin=(40, 0, 0, 40))
 
 
-def setup_data_explorer(manager: DataManager) -> Column:
+def setup_client_animation(data: Dict[int, dict], years: List[int], numeric_columns: List[str],
+                           source: ColumnDataSource, plot: Figure, label: Label, slider: Slider,
+                           play_button: Button) -> None:
+    """Make the slider and the play button of the gapminder plot change the year in the
+    browser. The data of every year is sent once, in a hidden data source, and the
+    animation is driven by a timer in the browser.
+
+    The year is shown by a text glyph instead of the label, which is hidden. Every frame
+    only replaces the data of data sources in place, so a playing animation sends the
+    server no messages; the slider is moved to the shown year when the animation stops.
+
+    Preconditions:
+        - all(year in data for year in years)
+    """
+    # The column '<year>:<indicator>' holds the values of the indicator in that year.
+    frames = ColumnDataSource({f'{year}:{column}': data[year][column]
+                               for year in years for column in numeric_columns})
+
+    label.visible = False
+    year_source = ColumnDataSource({'x': [label.x], 'y': [label.y], 'text': [label.text]})
+    plot.text(x='x', y='y', text='text', source=year_source, text_font_size=label.text_font_size,
+              text_color=label.text_color)
+
+    # Columns are replaced in place and the change is only emitted to the views, so the
+    # new data is not sent back to the server.
+    show_year = """
+        function show_year(year) {
+            year_source.data['text'][0] = String(year)
+            year_source.change.emit()
+            if (frames.data[year + ':' + columns[0]] !== undefined) {
+                for (const column of columns) {
+                    source.data[column] = frames.data[year + ':' + column]
+                }
+                source.change.emit()
+            }
+        }
+    """
+    args = dict(source=source, frames=frames, year_source=year_source, columns=numeric_columns,
+                slider=slider, button=play_button, years=years, interval=ANIMATION_INTERVAL)
+
+    slider.js_on_change('value', CustomJS(args=args, code=show_year + """
+        button._gapminder_year = slider.value
+        show_year(slider.value)
+    """))
+
+    # The year shown by a playing animation is kept in a plain attribute of the button
+    # object of the browser, which is not a property of the model, so it is not synced.
+    play_button.js_on_click(CustomJS(args=args, code=show_year + """
+        function stop() {
+            clearInterval(button._gapminder_timer)
+            button._gapminder_timer = null
+            button.label = '► Play'
+            slider.value = button._gapminder_year
+        }
+
+        if (button._gapminder_timer == null) {
+            button.label = '❚❚ Pause'
+            button._gapminder_year = slider.value
+            button._gapminder_timer = setInterval(() => {
+                // The next year in the list, starting over after the last one.
+                let year = years.find((y) => y > button._gapminder_year)
+                if (year === undefined) {
+                    year = years[0]
+                }
+                button._gapminder_year = year
+                show_year(year)
+                if (year === years[years.length - 1]) {
+                    stop()
+                }
+            }, interval)
+        } else {
+            stop()
+        }
+    """))
+
+
+def setup_data_explorer(manager: DataManager, bk_document: Optional[doc] = None) -> Column:
     """Setting up for the "data explorer" part of the presentation.
     Returns a Column object, which is a component of the layout.
 
+    The queries are computed outside of the IO loop of the server, by a SessionWorker of
+    the given document, so a heavy query does not delay the other sessions. With
+    bk_document None, they are computed in the callbacks.
+
     Preconditions:
         - manager is loaded with at least two kinds of data.
     """
@@ -137,9 +376,8 @@ def setup_data_explorer(manager: DataManager) -> Column:
     ind_var_dropdown = Dropdown(label='Independent Variable', menu=indicator_menu)
     dep_var_dropdown = Dropdown(label='Dependent Variable', menu=indicator_menu)
 
-    reg_func_menu = [('Linear regression', 'Linear regression'),
-                     ('Least-square exponential', 'Least-square exponential'),
-                     ('None', 'None')]
+    reg_func_menu = [(name, name) for name in LINE_REGRESSIONS] + \
+                    [('Least-square exponential', 'Least-square exponential'), ('None', 'None')]
     reg_func_dropdown = Dropdown(label='Regression Function', menu=reg_func_menu)
 
     region_menu = ['All'] + [None] + [(region, region) for region in manager.get_regions()] + \
@@ -153,8 +391,44 @@ def setup_data_explorer(manager: DataManager) -> Column:
                               region_dropdown, year_range_slider, plot_button,
                               margin=(24, 0, 0, 0))
 
-    explorer_plot = create_scatter_plot([], 'HDI', 'Air Pollution')
+    # This figure is kept for the whole session; Plot Data only updates its data.
+    explorer_plot = create_explorer_plot(compute_explorer_result(numpy.empty(0), numpy.empty(0),
+                                                                 'None'),
+                                         'HDI', 'Air Pollution')
     data_explorer = row(explorer_buttons, explorer_plot, margin=(40, 0, 0, 0))
+    worker = SessionWorker(bk_document, 'explorer_query')
+    detail_worker = SessionWorker(bk_document, 'explorer_detail')
+    band_worker = SessionWorker(bk_document, 'explorer_band')
+
+    # The result shown in explorer_plot.
+    shown_result = None
+
+    def show_result(result: ExplorerResult, x_axis_name: str, y_axis_name: str) -> None:
+        """Show the given result in explorer_plot."""
+        nonlocal shown_result
+        shown_result = result
+        update_explorer_plot(explorer_plot, result, x_axis_name, y_axis_name)
+
+    def ranges_update(event: RangesUpdate) -> None:
+        """Function called when explorer_plot is zoomed or panned. When the result has too
+        many points to send them all, send a sample of the visible ones."""
+        if shown_result is None or len(shown_result.x_coords) <= LOD_THRESHOLD:
+            return
+
+        result = shown_result
+        bounds = (event.x0, event.x1, event.y0, event.y1)
+        if any(bound is None for bound in bounds):
+            bounds = None
+        source = explorer_plot.select_one({'name': 'points'}).data_source
+        size = (explorer_plot.plot_width, explorer_plot.plot_height)
+
+        def apply(points: Tuple[numpy.ndarray, numpy.ndarray]) -> None:
+            """Show the sample, unless another result was shown since it was requested."""
+            if shown_result is result:
+                update_source(source, {'x': points[0], 'y': points[1]})
+
+        detail_worker.submit(
+            lambda: level_of_detail(result.x_coords, result.y_coords, *size, bounds), apply)
 
     def ind_var_update(event):
         """Function called when the independent variable dropdown is changed.
@@ -179,48 +453,196 @@ def setup_data_explorer(manager: DataManager) -> Column:
     def plot_on_click() -> None:
         """Function called when plot button is clicked. It will create and display a
         plot based on the state of the dropdowns."""
+        metrics.EXPLORER_QUERIES.inc()
         if region_dropdown.label == 'All' or region_dropdown.label == 'Select Region':
             selected_region = None
         else:
             selected_region = region_dropdown.label
-        years = list(range(year_range_slider.value[0], year_range_slider.value[1] + 1))
-        selected_points = manager.get_data_points(years,
-                                                  ind_var_dropdown.label.lower(),
-                                                  dep_var_dropdown.label.lower(),
-                                                  selected_region)
-
-        if reg_func_dropdown.label == 'Linear regression':
-            new_plot = create_linear_regression_plot(selected_points,
-                                                     ind_var_dropdown.label,
-                                                     dep_var_dropdown.label,
-                                                     selected_region)
-        elif reg_func_dropdown.label == 'Least-square exponential':
-            new_plot = create_exponential_regression_plot(selected_points,
-                                                          ind_var_dropdown.label,
-                                                          dep_var_dropdown.label,
-                                                          selected_region)
-        else:
-            new_plot = create_scatter_plot(selected_points, ind_var_dropdown.label,
-                                           dep_var_dropdown.label)
-        data_explorer.children[1] = new_plot
+        # The state of the widgets is read now, on the IO loop, not by the worker thread.
+        query = (manager, ind_var_dropdown.label.lower(), dep_var_dropdown.label.lower(),
+                 selected_region, tuple(year_range_slider.value), reg_func_dropdown.label)
+        x_axis_name = ind_var_dropdown.label
+        y_axis_name = dep_var_dropdown.label
+
+        def apply(result: ExplorerResult) -> None:
+            """Show the result, then bootstrap the confidence band of its curve."""
+            show_result(result, x_axis_name, y_axis_name)
+            band_worker.submit(lambda: get_explorer_band(*query),
+                               lambda band: update_explorer_band(explorer_plot, band))
+
+        worker.submit(lambda: get_explorer_result(*query), apply)
 
     ind_var_dropdown.on_click(ind_var_update)
     dep_var_dropdown.on_click(dep_var_update)
     reg_func_dropdown.on_click(reg_func_update)
     region_dropdown.on_click(region_update)
     plot_button.on_click(plot_on_click)
+    explorer_plot.on_event(RangesUpdate, ranges_update)
 
     explorer_desc = Paragraph(text="""To explore more data, choose the variable names and 
     regression function, then click "Plot Data". """)
     return column(explorer_desc, data_explorer, margin=(80, 0, 0, 40))
 
 
-def replace_plot(old: Figure, new: Figure) -> None:
-    """Replace attribures of the old figure with that of the new figure."""
-    old.renderers = new.renderers
-    old.xaxis.axis_label = new.xaxis.axis_label
-    old.yaxis.axis_label = new.yaxis.axis_label
-    old.title = new.title
+def setup_correlation_heatmap(manager: DataManager, bk_document: Optional[doc] = None) -> Column:
+    """Setting up for the "correlations" part of the presentation: a heatmap of the
+    correlation coefficients of every pair of indicators.
+    Returns a Column object, which is a component of the layout.
+
+    Like the data explorer queries, the matrices are computed by a SessionWorker of the
+    given document.
+
+    Preconditions:
+        - manager is loaded with at least two kinds of data.
+    """
+    method_menu = [('Pearson', 'pearson'), ('Spearman', 'spearman')]
+    method_dropdown = Dropdown(label='Pearson', menu=method_menu)
+
+    region_menu = ['All'] + [None] + [(region, region) for region in manager.get_regions()] + \
+                  [None] + [(subreg, subreg) for subreg in manager.get_subregions()]
+    region_dropdown = Dropdown(label='All', menu=region_menu)
+
+    year_range_slider = RangeSlider(start=1990, end=2019, value=(1990, 2019),
+                                    step=1, title="Time interval")
+    heatmap_buttons = column(method_dropdown, region_dropdown, year_range_slider,
+                             margin=(24, 0, 0, 0))
+
+    # The method chosen in method_dropdown, as a key of CORRELATION_METHODS.
+    method = 'pearson'
+    indicators, r, n = manager.correlation_matrix(method, None, 1990, 2019)
+    source = ColumnDataSource(correlation_heatmap_data(indicators, r, n))
+    heatmap = create_correlation_heatmap(source, indicators)
+    heatmap_plot = row(heatmap_buttons, heatmap, margin=(40, 0, 0, 0))
+    worker = SessionWorker(bk_document, 'correlation_query')
+
+    def heatmap_update() -> None:
+        """Update the heatmap to the state of the dropdowns and the slider."""
+        region = None if region_dropdown.label == 'All' else region_dropdown.label
+        start, end = year_range_slider.value
+        query = (method, region, int(start), int(end))
+        worker.submit(lambda: correlation_heatmap_data(*manager.correlation_matrix(*query)),
+                      lambda data: update_source(source, data))
+
+    def method_update(event) -> None:
+        """Function called when the method dropdown is changed."""
+        nonlocal method
+        method = event.item
+        method_dropdown.label = dict((value, text) for text, value in method_menu)[event.item]
+        heatmap_update()
+
+    def region_update(event) -> None:
+        """Function called when the region dropdown is changed."""
+        region_dropdown.label = event.item
+        heatmap_update()
+
+    method_dropdown.on_click(method_update)
+    region_dropdown.on_click(region_update)
+    year_range_slider.on_change('value_throttled', lambda attr, old, new: heatmap_update())
+
+    heatmap_desc = Paragraph(text="""The correlation of every pair of indicators, computed from 
+    the years in which both are known for a country.""")
+    return column(heatmap_desc, heatmap_plot, margin=(80, 0, 0, 40))
+
+
+def correlation_heatmap_data(indicators: List[str], r: numpy.ndarray,
+                             n: numpy.ndarray) -> Dict[str, numpy.ndarray]:
+    """Returns the columns of the data source of the correlation heatmap: one rectangle
+    per pair of the given indicators, with the correlation coefficient r and the number
+    of data points n of the pair.
+
+    Preconditions:
+        - r.shape == n.shape == (len(indicators), len(indicators))
+    """
+    names = numpy.array([indicator.capitalize() for indicator in indicators], dtype=object)
+    k = len(indicators)
+    return {'x': numpy.repeat(names, k), 'y': numpy.tile(names, k),
+            'r': numpy.array(r, dtype=numpy.float64).ravel(),
+            'n': numpy.array(n, dtype=numpy.int64).ravel()}
+
+
+def create_correlation_heatmap(source: ColumnDataSource, indicators: List[str]) -> Figure:
+    """Returns the heatmap of the correlation coefficients in the given data source, which
+    has the columns returned by correlation_heatmap_data."""
+    names = [indicator.capitalize() for indicator in indicators]
+    mapper = LinearColorMapper(palette=RdBu11, low=-1, high=1, nan_color='#d3d3d3')
+
+    p = figure(title='Correlation of the Indicators', x_range=names,
+               y_range=list(reversed(names)), plot_width=800, plot_height=800,
+               tools='hover,save', tooltips=[('Indicators', '@x, @y'), ('r', '@r{0.000}'),
+                                             ('Data points', '@n')])
+    p.rect(x='x', y='y', width=1, height=1, source=source, line_color=None,
+           fill_color={'field': 'r', 'transform': mapper})
+    p.add_layout(ColorBar(color_mapper=mapper, width=12), 'right')
+    p.xaxis.major_label_orientation = 0.8
+    p.grid.grid_line_color = None
+
+    return p
+
+
+def update_explorer_plot(plot: Figure, result: ExplorerResult, x_axis_name: str,
+                         y_axis_name: str) -> None:
+    """Mutate the plot created by create_explorer_plot so that it shows the given result.
+
+    The figure itself is kept, so only the changed data columns, the title, and the axis
+    labels are sent to the browser, instead of a whole new figure. A result with more
+    than LOD_THRESHOLD points is shown as the sample of them taken with the result.
+    The confidence band is cleared until update_explorer_band is called.
+
+    Preconditions:
+        - plot was created by create_explorer_plot
+    """
+    update_explorer_band(plot, None)
+    update_source(plot.select_one({'name': 'points'}).data_source,
+                  {'x': result.sample_x, 'y': result.sample_y})
+    update_source(plot.select_one({'name': 'curve'}).data_source,
+                  {'x': result.curve_x, 'y': result.curve_y})
+
+    if plot.title is None:
+        plot.title = Title(text=result.title or '')
+    elif plot.title.text != (result.title or ''):
+        plot.title.text = result.title or ''
+    if plot.xaxis.axis_label != [x_axis_name]:
+        plot.xaxis.axis_label = x_axis_name
+    if plot.yaxis.axis_label != [y_axis_name]:
+        plot.yaxis.axis_label = y_axis_name
+
+
+def update_explorer_band(plot: Figure, band: Optional[bootstrap.ConfidenceBand]) -> None:
+    """Mutate the plot created by create_explorer_plot so that it shows the given
+    confidence band, or no band if band is None.
+
+    Preconditions:
+        - plot was created by create_explorer_plot
+    """
+    update_source(plot.select_one({'name': 'band'}).data_source, band_data(band))
+
+
+def band_data(band: Optional[bootstrap.ConfidenceBand]) -> Dict[str, numpy.ndarray]:
+    """Returns the data of the source of the area drawing the given confidence band."""
+    if band is None:
+        return {'x': numpy.empty(0), 'lower': numpy.empty(0), 'upper': numpy.empty(0)}
+    return {'x': band.x, 'lower': band.lower, 'upper': band.upper}
+
+
+def update_source(source: ColumnDataSource, data: Dict[str, numpy.ndarray]) -> None:
+    """Replace the data of the source with the given columns, sending as little as possible
+    to the browser.
+
+    If every column keeps its length, only the columns that changed are sent, as patches.
+    Otherwise the whole data is replaced. Columns are copied into the source, since the
+    given arrays may be shared between sessions.
+
+    Preconditions:
+        - all(len(data[name]) == len(data[next(iter(data))]) for name in data)
+    """
+    old = source.data
+    if set(old) == set(data) and all(len(old[name]) == len(data[name]) for name in data):
+        patches = {name: [(slice(0, len(data[name])), numpy.array(data[name]))]
+                   for name in data if not numpy.array_equal(old[name], data[name])}
+        if patches:
+            source.patch(patches)
+    else:
+        source.data = {name: numpy.array(data[name]) for name in data}
 
 
 def create_air_gpd_plot(source: ColumnDataSource, regions: List[str]) -> Figure:
@@ -239,7 +661,7 @@ def create_air_gpd_plot(source: ColumnDataSource, regions: List[str]) -> Figure:
         my_palette = Category20[len(regions)]
 
     color_mapper = CategoricalColorMapper(palette=my_palette, factors=regions)
-    plot.circle(
+    circles = plot.circle(
         x='gdp per capita',
         y='air pollution',
         radius_dimension='y',
@@ -252,103 +674,317 @@ def create_air_gpd_plot(source: ColumnDataSource, regions: List[str]) -> Figure:
         line_alpha=0.5,
         legend_group='region',
     )
-    plot.add_tools(HoverTool(tooltips="@name", show_arrow=False, point_policy='follow_mouse'))
+    plot.add_tools(HoverTool(renderers=[circles], tooltips="@name", show_arrow=False,
+                             point_policy='follow_mouse'))
 
     return plot
 
 
-def create_scatter_plot(points: List[Tuple[float, float]],
+def create_scatter_plot(x_coords: numpy.ndarray, y_coords: numpy.ndarray,
                         x_axis_name: str,
                         y_axis_name: str,
                         description: Optional[str] = None) -> Figure:
-    """Returns a bokeh scatter plot with a regression line.
+    """Returns a bokeh scatter plot of the points (x_coords[i], y_coords[i]).
 
     Preconditions:
+        - len(x_coords) == len(y_coords)
         - x_axis_name != ''
         - y_axis_name != ''
     """
-    if points == []:
+    if len(x_coords) == 0:
         description = 'No data to show.'
 
-    x_coords, y_coords = convert_points(points)
-
-    source = ColumnDataSource({'x': x_coords, 'y': y_coords})
+    # Large data is shown as a sample of the points (see downsample.py).
+    x_coords, y_coords = level_of_detail(numpy.asarray(x_coords, dtype=numpy.float64),
+                                         numpy.asarray(y_coords, dtype=numpy.float64),
+                                         EXPLORER_PLOT_SIZE, EXPLORER_PLOT_SIZE)
+    source = ColumnDataSource({'x': numpy.array(x_coords), 'y': numpy.array(y_coords)})
 
     # Rendering the figure
     p = figure(title=description, x_axis_label=x_axis_name, y_axis_label=y_axis_name,
-               plot_width=800, plot_height=800)
+               plot_width=EXPLORER_PLOT_SIZE, plot_height=EXPLORER_PLOT_SIZE)
 
     # add a circle renderer with a size, color, and alpha
-    p.scatter(x='x', y='y', line_color=None, size=5, fill_alpha=0.5, source=source)
+    p.scatter(x='x', y='y', line_color=None, size=5, fill_alpha=0.5, source=source,
+              name='points')
 
     return p
 
 
-def create_linear_regression_plot(points: List[Tuple[float, float]],
+class ExplorerResult:
+    """The data points of a data explorer plot and their curve of best fit.
+
+    Instance Attributes:
+        - x_coords: The x-coordinates of the data points.
+        - y_coords: The y-coordinates of the data points.
+        - fit: The result of the regression, or None if no regression was done.
+        - curve_x: The x-coordinates of the points of the curve of best fit.
+        - curve_y: The y-coordinates of the points of the curve of best fit.
+        - title: The title of the plot.
+        - weights: The weights of the data points in the regression, or None if they all
+        have the same weight.
+        - sample_x: The x-coordinates of the data points drawn when the whole plot is
+        shown, which are a sample of them if there are more than LOD_THRESHOLD points.
+        - sample_y: The y-coordinates of the data points drawn when the whole plot is shown.
+
+    Representation Invariants:
+        - len(self.x_coords) == len(self.y_coords)
+        - len(self.sample_x) == len(self.sample_y) <= len(self.x_coords)
+        - len(self.curve_x) == len(self.curve_y)
+        - self.fit is not None or len(self.curve_x) == 0
+        - self.weights is None or len(self.weights) == len(self.x_coords)
+    """
+    x_coords: numpy.ndarray
+    y_coords: numpy.ndarray
+    fit: Optional[RegressionResult]
+    curve_x: numpy.ndarray
+    curve_y: numpy.ndarray
+    title: Optional[str]
+    weights: Optional[numpy.ndarray]
+    sample_x: numpy.ndarray
+    sample_y: numpy.ndarray
+
+    def __init__(self, x_coords: numpy.ndarray, y_coords: numpy.ndarray,
+                 fit: Optional[RegressionResult], curve_x: numpy.ndarray,
+                 curve_y: numpy.ndarray, title: Optional[str],
+                 weights: Optional[numpy.ndarray] = None) -> None:
+        """Initialize the result, and sample the points drawn on a plot of
+        EXPLORER_PLOT_SIZE x EXPLORER_PLOT_SIZE pixels. The arrays are made read-only,
+        since results are shared between sessions."""
+        self.x_coords = x_coords
+        self.y_coords = y_coords
+        self.fit = fit
+        self.curve_x = curve_x
+        self.curve_y = curve_y
+        self.title = title
+        self.weights = weights
+        # The sample is taken here, in the thread computing the result, so that showing a
+        # result does not sample its points on the IO loop.
+        self.sample_x, self.sample_y = level_of_detail(x_coords, y_coords, EXPLORER_PLOT_SIZE,
+                                                       EXPLORER_PLOT_SIZE)
+        for array in (x_coords, y_coords, curve_x, curve_y, self.sample_x, self.sample_y):
+            array.flags.writeable = False
+        if weights is not None:
+            weights.flags.writeable = False
+
+    def nbytes(self) -> int:
+        """Returns the approximate number of bytes used by the result."""
+        weights_nbytes = 0 if self.weights is None else self.weights.nbytes
+        sample_nbytes = 0 if self.sample_x is self.x_coords else \
+            self.sample_x.nbytes + self.sample_y.nbytes
+        return self.x_coords.nbytes + self.y_coords.nbytes + self.curve_x.nbytes + \
+            self.curve_y.nbytes + weights_nbytes + sample_nbytes + 512
+
+
+def create_linear_regression_plot(x_coords: numpy.ndarray, y_coords: numpy.ndarray,
                                   x_axis_name: str,
                                   y_axis_name: str,
-                                  description: Optional[str] = None) -> Figure:
-    """Returns a bokeh scatter plot with a regression line.
+                                  description: Optional[str] = None,
+                                  band: Optional[bootstrap.ConfidenceBand] = None) -> Figure:
+    """Returns a bokeh scatter plot with a regression line, and the given confidence band
+    of the line if it is not None (see explorer_band).
 
     Preconditions:
+        - len(x_coords) == len(y_coords)
         - x_axis_name != ''
         - y_axis_name != ''
     """
-    # Rendering the figure
-    p = create_scatter_plot(points, x_axis_name, y_axis_name, description)
+    result = compute_explorer_result(x_coords, y_coords, 'Linear regression', description)
+    return create_explorer_plot(result, x_axis_name, y_axis_name, band)
 
-    if points == []:
-        return p    # Returning an empty scatter plot
 
-    x_coords, y_coords = convert_points(points)
-    a, b = linear_regression(points)
-    r2 = calculate_r_squared(points, a, b)
+def create_exponential_regression_plot(x_coords: numpy.ndarray, y_coords: numpy.ndarray,
+                                       x_axis_name: str,
+                                       y_axis_name: str,
+                                       description: Optional[str] = None,
+                                       band: Optional[bootstrap.ConfidenceBand] = None) \
+        -> Figure:
+    """Returns a bokeh scatter plot with an exponential regression curve of best fit (least-
+    square fit), and the given confidence band of the curve if it is not None (see
+    explorer_band).
 
-    x_min = min(x_coords)
-    x_max = max(x_coords)
+    Preconditions:
+        - len(x_coords) == len(y_coords)
+        - x_axis_name != ''
+        - y_axis_name != ''
+    """
+    result = compute_explorer_result(x_coords, y_coords, 'Least-square exponential',
+                                     description)
+    return create_explorer_plot(result, x_axis_name, y_axis_name, band)
+
+
+def create_explorer_plot(result: ExplorerResult, x_axis_name: str, y_axis_name: str,
+                         band: Optional[bootstrap.ConfidenceBand] = None) -> Figure:
+    """Returns a bokeh scatter plot of the data of the given result, with its curve of best
+    fit if it has one, and the given confidence band of the curve if it is not None.
 
-    p.line([x_min, x_max],
-           [evaluate_line(a, b, 0, x_min), evaluate_line(a, b, 0, x_max)],
-           line_width=3,
-           line_alpha=0.6,
-           color='firebrick')
+    Preconditions:
+        - x_axis_name != ''
+        - y_axis_name != ''
+    """
+    p = create_scatter_plot(result.sample_x, result.sample_y, x_axis_name, y_axis_name,
+                            result.title)
 
-    p.title = Title(text=f"y = {round(a, 3)}x + ({round(b, 3)}), r^2 = {round(r2, 4)}")
+    # Like the curve, the band is always added so update_explorer_band can fill it later.
+    band_source = ColumnDataSource({name: numpy.array(values)
+                                    for name, values in band_data(band).items()})
+    p.varea(x='x', y1='lower', y2='upper', source=band_source, fill_alpha=0.2,
+            fill_color='firebrick', name='band')
+
+    # The curve is always added, even when empty, so update_explorer_plot can fill it later.
+    curve_source = ColumnDataSource({'x': numpy.array(result.curve_x),
+                                     'y': numpy.array(result.curve_y)})
+    p.line(x='x', y='y', source=curve_source, line_width=3, line_alpha=0.6, color='firebrick',
+           name='curve')
 
     return p
 
 
-def create_exponential_regression_plot(points: List[Tuple[float, float]],
-                                       x_axis_name: str,
-                                       y_axis_name: str,
-                                       description: Optional[str] = None) -> Figure:
-    """Returns a bokeh scatter plot with an exponential regression curve of best fit (least-
-    square fit).
+def compute_explorer_result(x_coords: numpy.ndarray, y_coords: numpy.ndarray, reg_func: str,
+                            description: Optional[str] = None,
+                            weights: Optional[numpy.ndarray] = None) -> ExplorerResult:
+    """Returns the result of fitting the regression function named reg_func to the points
+    (x_coords[i], y_coords[i]). No regression is done if reg_func is not in
+    LINE_REGRESSIONS or 'Least-square exponential', or if there are no points.
+
+    The title is the equation of the curve of best fit if there is one, 'No data to show.'
+    if there are no points, and the given description otherwise. It also says when the
+    curve has no confidence band because there are too many points (see has_band).
 
     Preconditions:
-        - x_axis_name != ''
-        - y_axis_name != ''
+        - len(x_coords) == len(y_coords)
+        - reg_func != 'Population-weighted linear' or len(weights) == len(x_coords)
     """
-    #  Initiate a scatter plot.
-    p = create_scatter_plot(points, x_axis_name, y_axis_name, description)
+    empty = numpy.empty(0)
+    if len(x_coords) == 0:
+        return ExplorerResult(x_coords, y_coords, None, empty, empty.copy(), 'No data to show.')
+
+    x_min = float(x_coords.min())
+    x_max = float(x_coords.max())
+    if reg_func in LINE_REGRESSIONS:
+        if reg_func == 'Population-weighted linear':
+            fit = weighted_linear_fit(x_coords, y_coords, weights)
+        elif reg_func == 'Theil-Sen (robust)':
+            fit = theil_sen_fit(x_coords, y_coords)
+        elif reg_func == 'Huber (robust)':
+            fit = huber_fit(x_coords, y_coords)
+        else:
+            fit = linear_fit(x_coords, y_coords)
+        a, b, r2 = fit.a, fit.b, fit.r_squared
+        curve_x = numpy.array([x_min, x_max])
+        curve_y = evaluate_line(a, b, 0, curve_x)
+        title = f"y = {round(b, 3)}x + ({round(a, 3)}), r^2 = {round(r2, 4)}"
+    elif reg_func == 'Least-square exponential':
+        fit = exponential_fit(x_coords, y_coords)
+        a, b = fit.a, fit.b
+        # Sample the curve only as finely as the plot can show.
+        curve_x, curve_y = sample_curve(lambda x: evaluate_exponential_curve(a, b, 0, x),
+                                        x_min, x_max, EXPLORER_PLOT_SIZE, EXPLORER_PLOT_SIZE)
+        title = f"y = {round(a, 4)} * (e**({round(b, 4)} * x))"
+    else:
+        return ExplorerResult(x_coords, y_coords, None, empty, empty.copy(), description)
 
-    if points == []:
-        return p    # Returning an empty scatter plot
+    if reg_func in BAND_REGRESSIONS and len(x_coords) > BAND_MAX_POINTS:
+        title += f" (no confidence band above {BAND_MAX_POINTS} points)"
+    if reg_func != 'Population-weighted linear':
+        weights = None
+    return ExplorerResult(x_coords, y_coords, fit, curve_x, curve_y, title, weights)
 
-    x_coords, y_coords = convert_points(points)
-    a, b = least_square_exponential_regression(points)
 
-    x_min = min(x_coords)
-    x_max = max(x_coords)
-    # Generate x-coordinates for the curve based on x-max and x-min.
-    xx = numpy.linspace(x_min, x_max, 200)
-    curve_x = xx.tolist()
-    curve_y = [evaluate_exponential_curve(a, b, 0, x) for x in xx]
+def get_explorer_result(manager: DataManager, indicator1: str, indicator2: str,
+                        region: Optional[str], year_range: Tuple[int, int],
+                        reg_func: str) -> ExplorerResult:
+    """Returns the result of the data explorer query: the data points of the given
+    indicators in the given region and years (inclusive), and their curve of best fit.
 
-    p.line(curve_x, curve_y, line_width=3, line_alpha=0.6, color='firebrick')
+    With 'Population-weighted linear', only the points with a population are returned,
+    and each point is weighted by the population of its country in its year.
 
-    p.title = Title(text=f"y = {round(a, 4)} * (e**({round(b, 4)} * x))")
-    return p
+    The results are kept in EXPLORER_CACHE, keyed by the whole query and the version of
+    the data, so a query repeated by any session is not computed again.
+
+    Preconditions:
+        - indicator1 != '' and indicator2 != ''
+        - year_range[0] <= year_range[1]
+    """
+    key = (manager.version, indicator1, indicator2, region, year_range[0], year_range[1],
+           reg_func)
+
+    def compute() -> ExplorerResult:
+        """Query the data and fit the curve."""
+        if reg_func == 'Population-weighted linear':
+            x_coords, y_coords, weights = manager.get_weighted_data_arrays(
+                year_range[0], year_range[1], indicator1, indicator2, WEIGHT_INDICATOR, region)
+            return compute_explorer_result(x_coords, y_coords, reg_func, region, weights)
+
+        x_coords, y_coords = manager.get_data_arrays(year_range[0], year_range[1],
+                                                     indicator1, indicator2, region)
+        return compute_explorer_result(x_coords, y_coords, reg_func, region)
+
+    return EXPLORER_CACHE.get_or_compute(key, compute)
+
+
+def has_band(result: ExplorerResult, reg_func: str) -> bool:
+    """Returns whether the curve of best fit of the given result, fitted with the
+    regression function named reg_func, is shown with a confidence band: whether it has a
+    curve, reg_func is in BAND_REGRESSIONS, and there are at most BAND_MAX_POINTS points.
+    """
+    return result.fit is not None and reg_func in BAND_REGRESSIONS \
+        and len(result.x_coords) <= BAND_MAX_POINTS
+
+
+def explorer_band(result: ExplorerResult, reg_func: str) -> Optional[bootstrap.ConfidenceBand]:
+    """Returns the bootstrapped confidence band of the curve of best fit of the given
+    result, fitted with the regression function named reg_func, or None if it has no band
+    (see has_band).
+
+    A line is evaluated at BAND_POINTS x-coordinates, since its band is not straight,
+    and an exponential curve at the x-coordinates of the curve. At most BAND_MAX_DRAWS
+    points are drawn.
+    """
+    if not has_band(result, reg_func):
+        return None
+
+    kind = BAND_REGRESSIONS[reg_func]
+    if kind == 'linear':
+        band_x = numpy.linspace(result.curve_x[0], result.curve_x[-1], BAND_POINTS)
+    else:
+        band_x = result.curve_x
+    n = len(result.x_coords)
+    resamples = min(BAND_RESAMPLES, BAND_MAX_DRAWS // n)
+    return bootstrap.bootstrap_band(result.x_coords, result.y_coords, kind, band_x,
+                                    result.weights, resamples)
+
+
+def get_explorer_band(manager: DataManager, indicator1: str, indicator2: str,
+                      region: Optional[str], year_range: Tuple[int, int],
+                      reg_func: str) -> Optional[bootstrap.ConfidenceBand]:
+    """Returns the confidence band of the curve of best fit of the data explorer query
+    of get_explorer_result, or None if it has no band (see explorer_band).
+
+    The bands are kept in EXPLORER_CACHE like the results of the queries. They are
+    computed separately, so that a query is shown before its band is ready.
+
+    Preconditions:
+        - indicator1 != '' and indicator2 != ''
+        - year_range[0] <= year_range[1]
+    """
+    result = get_explorer_result(manager, indicator1, indicator2, region, year_range, reg_func)
+    if not has_band(result, reg_func):
+        return None
+
+    key = (manager.version, indicator1, indicator2, region, year_range[0], year_range[1],
+           reg_func, 'band')
+    return EXPLORER_CACHE.get_or_compute(key, lambda: explorer_band(result, reg_func))
+
+
+def set_explorer_cache_limit(max_bytes: int) -> None:
+    """Set the maximum number of bytes of data kept in EXPLORER_CACHE.
+
+    Preconditions:
+        - max_bytes >= 0
+    """
+    EXPLORER_CACHE.resize(EXPLORER_CACHE.max_entries, max_bytes)
 
 
 if __name__ == '__main__':
@@ -10,7 +10,21 @@ This module provide functions for regressions and other calculations on data poi
 import math
 import random
 
-from typing import List, Tuple
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy
+
+# The number of equal segments that sample_curve starts from.
+CURVE_SEGMENTS = 16
+
+# The number of random pairs of points whose slopes theil_sen_fit takes the median of.
+THEIL_SEN_PAIRS = 200000
+
+# The residual (in robust standard deviations) beyond which huber_fit down-weights a point.
+HUBER_DELTA = 1.345
+
+# The maximum number of reweighting steps of huber_fit.
+HUBER_MAX_STEPS = 50
 
 
 def convert_points(points: list) -> tuple:
@@ -36,6 +50,419 @@ def average(nums: list) -> float:
     return sum(nums) / len(nums)
 
 
+class RegressionResult:
+    """The result of fitting the curve y = f(x; a, b) to data points.
+
+    For a linear fit, the curve is y = a + bx. For an exponential fit, the curve is
+    y = exp(a) * e^(bx), which is the line ln(y) = a + bx.
+
+    Instance Attributes:
+        - a: The first coefficient of the curve.
+        - b: The second coefficient of the curve.
+        - r_squared: The coefficient of determination of the curve on the data points.
+        - n: The number of data points.
+        - residual_sum: The sum of the squared residuals of the fitted line.
+        - residual_std: The standard error of the regression, sqrt(residual_sum / (n - 2)).
+        - std_error_a: The standard error of a.
+        - std_error_b: The standard error of b.
+
+    Representation Invariants:
+        - self.n > 0
+        - self.residual_sum >= 0
+    """
+    a: float
+    b: float
+    r_squared: float
+    n: int
+    residual_sum: float
+    residual_std: float
+    std_error_a: float
+    std_error_b: float
+
+    def __init__(self, a: float, b: float, r_squared: float, n: int, residual_sum: float,
+                 std_error_a: float, std_error_b: float) -> None:
+        """Initialize the result of a regression."""
+        self.a = a
+        self.b = b
+        self.r_squared = r_squared
+        self.n = n
+        self.residual_sum = residual_sum
+        self.residual_std = math.sqrt(residual_sum / (n - 2)) if n > 2 else math.nan
+        self.std_error_a = std_error_a
+        self.std_error_b = std_error_b
+
+
+def to_arrays(points: List[Tuple[float, float]]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Return a tuple of two contiguous float arrays, containing the x- and y-coordinates
+    of the given points.
+
+    >>> x, y = to_arrays([(1.0, 2.0), (3.0, 4.0)])
+    >>> x.tolist(), y.tolist()
+    ([1.0, 3.0], [2.0, 4.0])
+    """
+    xy = numpy.array(points, dtype=numpy.float64).reshape((len(points), 2))
+    return (numpy.ascontiguousarray(xy[:, 0]), numpy.ascontiguousarray(xy[:, 1]))
+
+
+def weighted_line_fit(x: numpy.ndarray, y: numpy.ndarray,
+                      w: Optional[numpy.ndarray] = None) -> Tuple[float, float, float, float]:
+    """Fit the line y = a + bx to the given points by (weighted) least squares.
+
+    Returns a tuple (a, b, residual_sum, sxx), where residual_sum is the weighted sum of
+    the squared residuals and sxx is the weighted sum of the squared deviations of x.
+    The sums are taken over deviations from the (weighted) means, so that large values
+    of x and y do not lose precision.
+
+    Raises ZeroDivisionError if all x values are the same.
+
+    Preconditions:
+        - len(x) == len(y) > 0
+        - w is None or (len(w) == len(x) and all(w > 0))
+    """
+    if w is None:
+        x_mean = x.mean()
+        y_mean = y.mean()
+        dx = x - x_mean
+        dy = y - y_mean
+        sxx = float(numpy.dot(dx, dx))
+        sxy = float(numpy.dot(dx, dy))
+        syy = float(numpy.dot(dy, dy))
+    else:
+        w_sum = w.sum()
+        x_mean = numpy.dot(w, x) / w_sum
+        y_mean = numpy.dot(w, y) / w_sum
+        dx = x - x_mean
+        dy = y - y_mean
+        wdx = w * dx
+        sxx = float(numpy.dot(wdx, dx))
+        sxy = float(numpy.dot(wdx, dy))
+        syy = float(numpy.dot(w * dy, dy))
+
+    b = sxy / sxx
+    a = float(y_mean) - b * float(x_mean)
+    # The residual sum of a least-square line, computed from the centred sums.
+    residual_sum = max(syy - b * sxy, 0.0)
+
+    return (a, b, residual_sum, sxx)
+
+
+def linear_fit(x: numpy.ndarray, y: numpy.ndarray) -> RegressionResult:
+    """Perform a linear regression on the points (x[i], y[i]).
+
+    The fitted line is y = a + bx.
+
+    Preconditions:
+        - len(x) == len(y) > 0
+
+    >>> result = linear_fit(numpy.array([0.0, 1.0, 2.0]), numpy.array([1.0, 3.0, 5.0]))
+    >>> result.a, result.b, result.r_squared
+    (1.0, 2.0, 1.0)
+    """
+    n = len(x)
+    a, b, residual_sum, sxx = weighted_line_fit(x, y)
+    x_mean = float(x.mean())
+
+    return RegressionResult(a, b, r_squared(x, y, a, b), n, residual_sum,
+                            *_standard_errors(residual_sum, n, float(n), x_mean, sxx))
+
+
+def exponential_fit(x: numpy.ndarray, y: numpy.ndarray) -> RegressionResult:
+    """Perform a least-square exponential regression on the points (x[i], y[i]).
+
+    The fitted curve is y = exp(a) * e^(bx). The line ln(y) = a + bx is fitted with
+    weights y, so that the error is not exaggerated for small values of y.
+    The R squared value is calculated on the curve, not on the line.
+
+    Preconditions:
+        - len(x) == len(y) > 0
+        - all(y > 0)
+    """
+    n = len(x)
+    a, b, residual_sum, sxx = weighted_line_fit(x, numpy.log(y), y)
+    x_mean = float(numpy.dot(y, x) / y.sum())
+
+    y_mean = y.mean()
+    dy = y - y_mean
+    res = y - numpy.exp(a + b * x)
+    r2 = 1 - float(numpy.dot(res, res)) / float(numpy.dot(dy, dy))
+
+    return RegressionResult(a, b, r2, n, residual_sum,
+                            *_standard_errors(residual_sum, n, float(y.sum()), x_mean, sxx))
+
+
+def r_squared(x: numpy.ndarray, y: numpy.ndarray, a: float, b: float) -> float:
+    """Return the R squared value when the points (x[i], y[i]) are modelled as
+    the line y = a + bx.
+
+    Preconditions:
+        - len(x) == len(y) > 0
+    """
+    dy = y - y.mean()
+    res = y - (a + b * x)
+
+    return 1 - float(numpy.dot(res, res)) / float(numpy.dot(dy, dy))
+
+
+def weighted_linear_fit(x: numpy.ndarray, y: numpy.ndarray, w: numpy.ndarray) -> RegressionResult:
+    """Perform a weighted linear regression on the points (x[i], y[i]), where the point i
+    counts w[i] times as much as a point of weight 1.
+
+    The fitted line is y = a + bx. The R squared value is weighted the same way.
+
+    Preconditions:
+        - len(x) == len(y) == len(w) > 0
+        - all(w > 0)
+
+    >>> result = weighted_linear_fit(numpy.array([0.0, 1.0, 2.0, 3.0]),
+    ...                              numpy.array([1.0, 3.0, 5.0, 0.0]),
+    ...                              numpy.array([1.0, 1.0, 1.0, 1e-9]))
+    >>> round(result.a, 6), round(result.b, 6)
+    (1.0, 2.0)
+    """
+    n = len(x)
+    a, b, residual_sum, sxx = weighted_line_fit(x, y, w)
+    w_sum = float(w.sum())
+    x_mean = float(numpy.dot(w, x)) / w_sum
+    dy = y - numpy.dot(w, y) / w_sum
+    syy = float(numpy.dot(w * dy, dy))
+    r2 = 1 - residual_sum / syy if syy > 0 else math.nan
+
+    return RegressionResult(a, b, r2, n, residual_sum,
+                            *_standard_errors(residual_sum, n, w_sum, x_mean, sxx))
+
+
+def theil_sen_fit(x: numpy.ndarray, y: numpy.ndarray, max_pairs: int = THEIL_SEN_PAIRS,
+                  seed: int = 0) -> RegressionResult:
+    """Perform a Theil-Sen regression on the points (x[i], y[i]).
+
+    The slope b of the fitted line y = a + bx is the median of the slopes of the lines
+    through two of the points, and a is the median of y - bx, so that up to about 29% of
+    the points can be outliers without moving the line much.
+
+    If there are more than max_pairs pairs of points, the median is taken over max_pairs
+    random pairs drawn with the given seed instead of every pair, which keeps the fit O(n)
+    for any number of points. The standard errors are those of a least-square line with
+    the same residuals.
+
+    Raises ZeroDivisionError if all x values are the same.
+
+    Preconditions:
+        - len(x) == len(y) > 0
+        - max_pairs > 0
+
+    >>> result = theil_sen_fit(numpy.array([0.0, 1.0, 2.0, 3.0, 4.0]),
+    ...                        numpy.array([1.0, 3.0, 5.0, 7.0, -100.0]))
+    >>> result.a, result.b
+    (1.0, 2.0)
+    """
+    n = len(x)
+    if n * (n - 1) // 2 <= max_pairs:
+        first, second = numpy.triu_indices(n, 1)
+    else:
+        generator = numpy.random.default_rng(seed)
+        first = generator.integers(0, n, max_pairs)
+        second = generator.integers(0, n, max_pairs)
+
+    dx = x[second] - x[first]
+    distinct = dx != 0
+    if not distinct.any():
+        raise ZeroDivisionError
+
+    b = float(numpy.median((y[second] - y[first])[distinct] / dx[distinct]))
+    a = float(numpy.median(y - b * x))
+
+    res = y - (a + b * x)
+    residual_sum = float(numpy.dot(res, res))
+    x_mean = float(x.mean())
+    dx = x - x_mean
+    return RegressionResult(a, b, r_squared(x, y, a, b), n, residual_sum,
+                            *_standard_errors(residual_sum, n, float(n), x_mean,
+                                              float(numpy.dot(dx, dx))))
+
+
+def huber_fit(x: numpy.ndarray, y: numpy.ndarray, delta: float = HUBER_DELTA,
+              max_steps: int = HUBER_MAX_STEPS, tolerance: float = 1e-4) -> RegressionResult:
+    """Perform a Huber regression on the points (x[i], y[i]).
+
+    The fitted line y = a + bx minimizes the Huber loss of the residuals: the square of
+    the residuals within delta robust standard deviations of the line, and their absolute
+    value beyond, so that outliers pull the line less than in a least-square fit. The
+    robust standard deviation is estimated from the median absolute deviation of the
+    residuals.
+
+    The line is found by iteratively reweighted least squares, starting from the
+    least-square line, for at most max_steps steps or until the line moves by less than
+    tolerance robust standard deviations. Every step is O(n). The R squared value is not
+    weighted; the standard errors are those of the last weighted least-square line.
+
+    Raises ZeroDivisionError if all x values are the same.
+
+    Preconditions:
+        - len(x) == len(y) > 0
+        - delta > 0
+        - max_steps >= 0
+
+    >>> result = huber_fit(numpy.arange(8.0),
+    ...                    numpy.array([1.0, 3.1, 4.9, 7.0, 9.1, 10.9, 13.0, -100.0]))
+    >>> round(result.b, 1)
+    2.0
+    """
+    n = len(x)
+    w = numpy.ones(n)
+    a, b, residual_sum, sxx = weighted_line_fit(x, y)
+    x_size = float(numpy.abs(x).max())
+
+    for _ in range(max_steps):
+        res = y - (a + b * x)
+        scale = 1.4826 * float(numpy.median(numpy.abs(res - numpy.median(res))))
+        if not scale > 0:
+            break
+
+        threshold = delta * scale
+        w = threshold / numpy.maximum(numpy.abs(res), threshold)
+        new_a, new_b, residual_sum, sxx = weighted_line_fit(x, y, w)
+        moved = abs(new_a - a) + abs(new_b - b) * x_size
+        a, b = new_a, new_b
+        if moved <= tolerance * scale:
+            break
+
+    w_sum = float(w.sum())
+    return RegressionResult(a, b, r_squared(x, y, a, b), n, residual_sum,
+                            *_standard_errors(residual_sum, n, w_sum,
+                                              float(numpy.dot(w, x)) / w_sum, sxx))
+
+
+def line_fits_from_sums(n: numpy.ndarray, sum_x: numpy.ndarray, sum_y: numpy.ndarray,
+                        sum_xx: numpy.ndarray, sum_xy: numpy.ndarray, sum_yy: numpy.ndarray,
+                        x_shift: float = 0.0, y_shift: float = 0.0) \
+        -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """Fit the line y = a + bx to many groups of points at once, from the sums of every
+    group: its number of points n, and the sums of x, y, x^2, xy, and y^2.
+
+    The sums may be taken over x - x_shift and y - y_shift instead of x and y. Shifting the
+    values by their mean keeps the sums small, so that they do not lose precision.
+    Returns the arrays of a, b, and the R squared values of the groups. They are NaN for
+    the groups with fewer than two points or whose x values are all the same.
+
+    Preconditions:
+        - all the arrays have the same shape.
+
+    >>> x, y = numpy.array([0.0, 1.0, 2.0]), numpy.array([1.0, 3.0, 5.0])
+    >>> sums = [numpy.array([v]) for v in (3, x.sum(), y.sum(), x @ x, x @ y, y @ y)]
+    >>> [float(array[0]) for array in line_fits_from_sums(*sums)]
+    [1.0, 2.0, 1.0]
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        x_mean = sum_x / n
+        y_mean = sum_y / n
+        sxx = sum_xx - sum_x * x_mean
+        sxy = sum_xy - sum_x * y_mean
+        syy = sum_yy - sum_y * y_mean
+        b = sxy / sxx
+        a = (y_mean + y_shift) - b * (x_mean + x_shift)
+        r2 = numpy.minimum(sxy * sxy / (sxx * syy), 1.0)
+
+    invalid = (n < 2) | ~(sxx > 0)
+    a[invalid] = numpy.nan
+    b[invalid] = numpy.nan
+    r2[invalid] = numpy.nan
+    return (a, b, r2)
+
+
+def pearson_matrix(values: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Returns the matrix of the Pearson correlation coefficients of every pair of rows of
+    values, and the matrix of the numbers of observations they were computed from.
+
+    NaN values are missing. The coefficient of rows i and j uses the columns where both
+    rows have a value (pairwise-complete observations). It is NaN when there are fewer
+    than two such columns or when one of the rows is constant over them.
+
+    >>> r, n = pearson_matrix(numpy.array([[1.0, 2.0, 3.0, numpy.nan],
+    ...                                    [2.0, 4.0, 7.0, 1.0]]))
+    >>> round(float(r[0, 1]), 4), int(n[0, 1]), int(n[1, 1])
+    (0.9934, 3, 4)
+    """
+    data = numpy.ma.masked_invalid(values)
+    present = (~numpy.ma.getmaskarray(data)).astype(numpy.float64)
+    # Shifting every row by its mean keeps the sums small.
+    x = (data - data.mean(axis=1, keepdims=True)).filled(0.0)
+
+    # The sums over the columns where both rows are present, for every pair (i, j):
+    # sum_x[i, j] is the sum of row i, sum_xx[i, j] the sum of its squares.
+    n = present @ present.T
+    sum_x = x @ present.T
+    sum_xx = (x * x) @ present.T
+    sum_xy = x @ x.T
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        sxx = sum_xx - sum_x * sum_x / n
+        sxy = sum_xy - sum_x * sum_x.T / n
+        r = sxy / numpy.sqrt(sxx * sxx.T)
+
+    r[(n < 2) | ~(sxx > 0) | ~(sxx.T > 0)] = numpy.nan
+    return (numpy.clip(r, -1.0, 1.0), n.astype(numpy.int64))
+
+
+def spearman_matrix(values: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Returns the matrix of the Spearman rank correlation coefficients of every pair of
+    rows of values, and the matrix of the numbers of observations, like pearson_matrix.
+
+    The ranks depend on which columns are complete for a pair, so every pair is ranked
+    separately. Tied values get the average of their ranks.
+
+    >>> r, n = spearman_matrix(numpy.array([[1.0, 2.0, 3.0, numpy.nan],
+    ...                                     [2.0, 4.0, 7.0, 1.0]]))
+    >>> float(r[0, 1]), int(n[0, 1])
+    (1.0, 3)
+    """
+    present = ~numpy.isnan(values)
+    n = present.astype(numpy.float64) @ present.T.astype(numpy.float64)
+    r = numpy.full(n.shape, numpy.nan)
+    for i in range(len(values)):
+        for j in range(i, len(values)):
+            both = present[i] & present[j]
+            if both.sum() >= 2:
+                ranks = numpy.stack([rank_values(values[i, both]), rank_values(values[j, both])])
+                r[i, j] = r[j, i] = pearson_matrix(ranks)[0][0, 1]
+
+    return (r, n.astype(numpy.int64))
+
+
+def rank_values(values: numpy.ndarray) -> numpy.ndarray:
+    """Returns the ranks (from 1) of the given values. Tied values get the average of
+    their ranks.
+
+    >>> rank_values(numpy.array([10.0, 30.0, 20.0, 20.0])).tolist()
+    [1.0, 4.0, 2.5, 2.5]
+    """
+    unique, inverse, counts = numpy.unique(values, return_inverse=True, return_counts=True)
+    # The values equal to unique[k] take the ranks after the ones of unique[:k].
+    first_ranks = numpy.cumsum(counts) - counts + 1
+    return (first_ranks + (counts - 1) / 2)[inverse].astype(numpy.float64)
+
+
+# Helper functions
+def _noise(error: float, x: Union[float, numpy.ndarray]) -> Union[float, numpy.ndarray]:
+    """Returns random error terms from -error to error, one for every value of x.
+    Returns 0 when error is 0, without drawing random numbers."""
+    if error == 0:
+        return 0.0
+    if isinstance(x, numpy.ndarray):
+        return numpy.random.uniform(-error, error, size=x.shape)
+    return random.uniform(-error, error)
+
+
+def _standard_errors(residual_sum: float, n: int, w_sum: float, x_mean: float,
+                     sxx: float) -> Tuple[float, float]:
+    """Returns the standard errors of the intercept and the slope of a least-square line.
+    Both are NaN when there are fewer than three points."""
+    if n <= 2:
+        return (math.nan, math.nan)
+
+    variance = residual_sum / (n - 2)
+    return (math.sqrt(variance * (1 / w_sum + x_mean ** 2 / sxx)), math.sqrt(variance / sxx))
+
+
 def linear_regression(points: List[Tuple[float, float]]) -> Tuple[float, float]:
     """Perform a linear regression on the given points.
 
@@ -46,11 +473,7 @@ def linear_regression(points: List[Tuple[float, float]]) -> Tuple[float, float]:
         - points is a list of pairs of floats: [(x_1, y_1), (x_2, y_2), ...]
         - len(points) > 0
     """
-    x = average([p[0] for p in points])
-    y = average([p[1] for p in points])
-    b = sum([(p[0] - x) * (p[1] - y) for p in points]) / sum([(p[0] - x) ** 2 for p in points])
-    a = y - b * x
-
+    a, b, _, _ = weighted_line_fit(*to_arrays(points))
     return (a, b)
 
 
@@ -64,10 +487,9 @@ def exponential_regression(points: List[Tuple[float, float]]) -> Tuple[float, fl
         - points is a list of pairs of floats: [(x_1, y_1), (x_2, y_2), ...]
         - len(points) > 0
     """
+    x, y = to_arrays(points)
     # The points in the form (x, log(y)):
-    new_points = [(p[0], math.log10(p[1])) for p in points]
-
-    slope, intercept = linear_regression(new_points)
+    slope, intercept, _, _ = weighted_line_fit(x, numpy.log10(y))
     a = 10**intercept
     b = 10**slope
 
@@ -78,20 +500,14 @@ def least_square_exponential_regression(points: List[Tuple[float, float]]) -> Tu
     """Perform an exponential regression on the given points.
 
     Returns a tuple (a, b) where a, b are the coefficients in the curve of best fit
-    equation y = ab^x.
+    equation y = exp(a) * e^(bx).
 
     Preconditions:
         - points is a list of pairs of floats: [(x_1, y_1), (x_2, y_2), ...]
         - len(points) > 0
     """
-    s_x2y = sum([(p[0] ** 2) * p[1] for p in points])
-    s_ylny = sum([p[1] * math.log(p[1]) for p in points])
-    s_xy = sum([p[0] * p[1] for p in points])
-    s_xylny = sum([p[0] * p[1] * math.log(p[1]) for p in points])
-    s_y = sum([p[1] for p in points])
-
-    a = (s_x2y * s_ylny - s_xy * s_xylny) / (s_y * s_x2y - s_xy ** 2)
-    b = (s_y * s_xylny - s_xy * s_ylny) / (s_y * s_x2y - s_xy ** 2)
+    x, y = to_arrays(points)
+    a, b, _, _ = weighted_line_fit(x, numpy.log(y), y)
 
     return (a, b)
 
@@ -106,27 +522,77 @@ def calculate_r_squared(points: list, a: float, b: float) -> float:
         - each element of points is a tuple containing two floats
 
     """
+    return r_squared(*to_arrays(points), a, b)
 
-    y = average([p[1] for p in points])
 
-    tot = sum([(p[1] - y)**2 for p in points])
-    res = sum([(p[1] - (a + b * p[0]))**2 for p in points])
+def evaluate_line(a: float, b: float, error: float,
+                  x: Union[float, numpy.ndarray]) -> Union[float, numpy.ndarray]:
+    """Evaluate the linear function y = a + bx for the given a, b, and x values
+    with the given error term. x may be a number or an array of numbers.
+    No random number is drawn when error is 0.
 
-    return 1 - (res / tot)
+    >>> evaluate_line(1.0, 2.0, 0, numpy.array([0.0, 1.0])).tolist()
+    [1.0, 3.0]
+    """
+    return a + b * x + _noise(error, x)
 
 
-def evaluate_line(a: float, b: float, error: float, x: float) -> float:
-    """Evaluate the linear function y = a + bx for the given a, b, and x values
-    with the given error term.
+def evaluate_exponential_curve(a: float, b: float, error: float,
+                               x: Union[float, numpy.ndarray]) -> Union[float, numpy.ndarray]:
+    """Evaluate the exponential curve exp(a)(e^(bx)) for the given a, b, and x values
+    with the given error term. x may be a number or an array of numbers.
+    No random number is drawn when error is 0.
+
+    >>> evaluate_exponential_curve(0.0, 1.0, 0, numpy.array([0.0, 1.0])).tolist() == [1.0, math.e]
+    True
     """
-    return a + b * x + random.uniform(-error, error)
+    if isinstance(x, numpy.ndarray):
+        return math.exp(a) * numpy.power(math.e, b * x) + _noise(error, x)
+    return math.exp(a) * (math.e ** (b * x)) + _noise(error, x)
 
 
-def evaluate_exponential_curve(a: float, b: float, error: float, x: float) -> float:
-    """Evaluate the exponential curve exp(a)(e^(bx)) for the given a, b, and x values
-    with the given error term.
+def sample_curve(function: Callable[[numpy.ndarray], numpy.ndarray], x_min: float,
+                 x_max: float, width: int = 800, height: int = 800,
+                 tolerance: float = 0.5) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Returns the x- and y-coordinates of the points of a polyline drawing the smooth
+    curve y = function(x) from x_min to x_max on a plot of width x height pixels.
+
+    The curve is sampled adaptively. It is first cut into CURVE_SEGMENTS equal segments.
+    The distance, in pixels, between the middle of every segment and the curve tells how
+    much the curve bends there. Since this distance shrinks with the square of the length
+    of a segment, each segment is then split into just enough pieces for the polyline to
+    stay within tolerance pixels of the curve, but no piece is narrower than a pixel.
+    The y-axis is assumed to span the values of the curve.
+
+        - function must accept and return arrays.
+
+    Preconditions:
+        - x_min <= x_max
+        - width > 0 and height > 0 and tolerance > 0
+
+    >>> x, y = sample_curve(lambda x: 2 * x + 1, 0.0, 10.0)
+    >>> len(x) == CURVE_SEGMENTS + 1
+    True
     """
-    return math.exp(a) * (math.e ** (b * x)) + random.uniform(-error, error)
+    x = numpy.linspace(x_min, x_max, CURVE_SEGMENTS + 1)
+    y = function(x)
+    middle = function((x[:-1] + x[1:]) / 2)
+    y_span = float(max(numpy.max(y), numpy.max(middle)) - min(numpy.min(y), numpy.min(middle)))
+    if not (y_span > 0 and math.isfinite(y_span)):
+        return (x, y)
+
+    # The distance (in pixels) between the middle of every segment and the curve. It is
+    # doubled since the curve may bend more in some parts of a segment than in its middle.
+    error = numpy.abs(middle - (y[:-1] + y[1:]) / 2) * (height / y_span)
+    max_pieces = max(1, math.ceil(width / CURVE_SEGMENTS))
+    pieces = numpy.clip(numpy.ceil(numpy.sqrt(2 * error / tolerance)), 1,
+                        max_pieces).astype(numpy.int64)
+
+    # The j-th point of segment i is at x[i] + (j / pieces[i]) * (length of a segment).
+    segments = numpy.repeat(numpy.arange(CURVE_SEGMENTS), pieces)
+    j = numpy.arange(len(segments)) - numpy.repeat(numpy.cumsum(pieces) - pieces, pieces)
+    curve_x = numpy.append(x[segments] + j / pieces[segments] * (x[1] - x[0]), x_max)
+    return (curve_x, function(curve_x))
 
 
 if __name__ == '__main__':
@@ -135,6 +601,6 @@ if __name__ == '__main__':
 
     import python_ta
     python_ta.check_all(config={
-        'extra-imports': ['random', 'plotly.graph_objects'],
+        'extra-imports': ['random', 'numpy', 'plotly.graph_objects'],
         'max-line-length': 100
     })
@@ -0,0 +1,131 @@
+"""
+CSC110 Course Project: Air Pollution and Forestry
+=========================================================================================
+SessionWorker Class
+Runs the heavy work of the callbacks of a session in a bounded pool of threads, so that
+the IO loop of the bokeh server, shared by every session, is never blocked by it.
+=========================================================================================
+@author: Tu Anh Pham
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from bokeh.document import Document
+
+import metrics
+
+# The default number of threads of the pool shared by every session of a process.
+DEFAULT_WORKERS = 4
+
+# The pool running the work of every session (see get_pool).
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class SessionWorker:
+    """Runs the work of the callbacks of one session in the shared pool of threads, and
+    applies the results to the session's document on the IO loop.
+
+    Only the latest request of a session matters: a request that has not started yet is
+    cancelled when a new one is submitted, and the result of a request that finishes
+    after a newer one was submitted is dropped.
+
+    Instance Attributes:
+        - stage: The stage under which the work is timed (see metrics.py).
+    """
+    # Private Instance Attributes:
+    #   - _document: The document of the session, or None if the work must be done in
+    #   the calling thread.
+    #   - _request: The number of requests submitted so far. It is only changed on the IO
+    #   loop.
+    #   - _future: The future of the latest request, or None before the first one.
+    _document: Optional[Document]
+    _request: int
+    _future: Optional[Future]
+
+    stage: str
+
+    def __init__(self, document: Optional[Document], stage: str) -> None:
+        """Initialize a worker for the session of the given document.
+        With document None, the work is done synchronously by submit."""
+        self._document = document
+        self._request = 0
+        self._future = None
+        self.stage = stage
+
+    def submit(self, compute: Callable[[], Any], apply: Callable[[Any], None]) -> None:
+        """Call compute() in the pool, then apply(result) on the IO loop, in the next tick
+        of the document, unless a newer request has been submitted by then.
+
+        compute must not touch the document, since it runs in another thread.
+        """
+        self._request += 1
+        request = self._request
+        if self._future is not None:
+            self._future.cancel()
+
+        if self._document is None:
+            apply(self._timed(compute))
+            return
+
+        self._future = get_pool().submit(self._timed, compute)
+        self._future.add_done_callback(partial(self._on_done, request, apply))
+
+    def _timed(self, compute: Callable[[], Any]) -> Any:
+        """Returns compute(), timed under self.stage."""
+        with metrics.timed(self.stage):
+            return compute()
+
+    def _on_done(self, request: int, apply: Callable[[Any], None], future: Future) -> None:
+        """Schedule the result of the given request to be applied, unless it is stale.
+        This is called by the thread that finished the work."""
+        if future.cancelled() or request != self._request:
+            metrics.STALE_REQUESTS.inc()
+            return
+
+        self._document.add_next_tick_callback(partial(self._apply, request, apply, future))
+
+    def _apply(self, request: int, apply: Callable[[Any], None], future: Future) -> None:
+        """Apply the result of the given request, unless it became stale while waiting
+        for the IO loop. An exception raised by the work is raised here, so the server
+        logs it."""
+        if request != self._request:
+            metrics.STALE_REQUESTS.inc()
+            return
+
+        apply(future.result())
+
+
+def get_pool() -> ThreadPoolExecutor:
+    """Returns the pool of threads shared by every session of this process, creating it
+    with DEFAULT_WORKERS threads if needed."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS,
+                                       thread_name_prefix='session-worker')
+        return _pool
+
+
+def set_worker_count(num_workers: int) -> None:
+    """Replace the pool of threads shared by every session with one of num_workers
+    threads. Work already submitted to the old pool still finishes.
+
+    Preconditions:
+        - num_workers > 0
+    """
+    global _pool
+    with _pool_lock:
+        old_pool = _pool
+        _pool = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='session-worker')
+
+    if old_pool is not None:
+        old_pool.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={'max-line-length': 100, 'extra-imports': ['bokeh.document']})
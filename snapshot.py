@@ -0,0 +1,131 @@
+"""
+CSC110 Course Project: Air Pollution and Forestry
+=========================================================================================
+snapshot.py
+Provides a binary cache of parsed data files. The first time a data file is loaded, the
+parsed table is saved next to it as a .npz snapshot, and later loads read the snapshot
+instead of parsing the text again.
+=========================================================================================
+@author: Tu Anh Pham
+"""
+import hashlib
+import os
+import zipfile
+from typing import List, Optional, Tuple
+
+import numpy
+
+import data_extract
+
+# The name of the folder, next to the data files, that stores the snapshots.
+SNAPSHOT_FOLDER = '.snapshots'
+
+# The version of the parser and of the snapshot format. Snapshots written with another
+# version are parsed again, so it must be increased whenever data_extract parses a file
+# differently or the content of a snapshot changes.
+SNAPSHOT_VERSION = 2
+
+
+def load_formatted_table(filepath: str) -> Tuple[List[str], List[str], List[int], numpy.ndarray]:
+    """Returns the same table as data_extract.read_formatted_table(filepath), reading it
+    from the snapshot of the file when the snapshot is up to date.
+
+    A snapshot is up to date when it was written with SNAPSHOT_VERSION and the file has
+    the same size and modification time as when the snapshot was written, or, failing
+    that, the same content hash. Otherwise the file is parsed again and its snapshot is
+    replaced. If the file changes while it is parsed, the snapshot is not written, since
+    the parsed table may not match the file.
+
+    Preconditions:
+        - the file follows the format described in the report.
+    """
+    stat = os.stat(filepath)
+    snapshot_path = get_snapshot_path(filepath)
+    snapshot = _read_snapshot(snapshot_path)
+
+    if snapshot is not None and int(snapshot.get('version', -1)) == SNAPSHOT_VERSION:
+        meta = snapshot['meta']
+        if int(meta[0]) == stat.st_size and int(meta[1]) == stat.st_mtime_ns:
+            return _unpack(snapshot)
+
+        file_hash = hash_file(filepath)
+        if int(meta[0]) == stat.st_size and str(snapshot['hash']) == file_hash:
+            # Only the modification time changed: keep the data, refresh the stamp.
+            snapshot['meta'] = numpy.array([stat.st_size, stat.st_mtime_ns], dtype=numpy.int64)
+            _write_snapshot(snapshot_path, snapshot)
+            return _unpack(snapshot)
+    else:
+        file_hash = hash_file(filepath)
+
+    names, codes, years, block = data_extract.read_formatted_table(filepath)
+    # The stamp was taken before the file was hashed and parsed, so it only describes the
+    # parsed content if the file has not changed since.
+    new_stat = os.stat(filepath)
+    if (new_stat.st_size, new_stat.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        return (names, codes, years, block)
+
+    _write_snapshot(snapshot_path, {
+        'version': numpy.array(SNAPSHOT_VERSION, dtype=numpy.int64),
+        'meta': numpy.array([stat.st_size, stat.st_mtime_ns], dtype=numpy.int64),
+        'hash': numpy.array(file_hash),
+        'names': numpy.array(names, dtype=str),
+        'codes': numpy.array(codes, dtype=str),
+        'years': numpy.array(years, dtype=numpy.int64),
+        'block': block
+    })
+
+    return (names, codes, years, block)
+
+
+def get_snapshot_path(filepath: str) -> str:
+    """Returns the path of the snapshot of the given data file."""
+    folder, filename = os.path.split(os.path.abspath(filepath))
+    return os.path.join(folder, SNAPSHOT_FOLDER, filename + '.npz')
+
+
+def hash_file(filepath: str) -> str:
+    """Returns the SHA-256 hash of the content of the given file, as a hex string."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+# Helper functions
+def _read_snapshot(snapshot_path: str) -> Optional[dict]:
+    """Returns the arrays saved in the given snapshot, or None if the snapshot does not
+    exist or cannot be read."""
+    try:
+        with numpy.load(snapshot_path, allow_pickle=False) as snapshot:
+            return {key: snapshot[key] for key in snapshot.files}
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+
+def _write_snapshot(snapshot_path: str, arrays: dict) -> None:
+    """Save the arrays to the given snapshot path. The snapshot is written to a temporary
+    file first, so a reader never sees a half-written snapshot.
+    Failing to write the snapshot is not an error: the data is parsed again next time."""
+    temp_path = snapshot_path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        with open(temp_path, 'wb') as file:
+            numpy.savez(file, **arrays)
+        os.replace(temp_path, snapshot_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _unpack(snapshot: dict) -> Tuple[List[str], List[str], List[int], numpy.ndarray]:
+    """Returns the table saved in the given snapshot."""
+    return (snapshot['names'].tolist(), snapshot['codes'].tolist(),
+            snapshot['years'].tolist(), snapshot['block'])
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={'max-line-length': 100, 'extra-imports': ['numpy']})